@@ -1 +1,5 @@
 # core package
+
+# versão do provider de dados (entra no state_id); aqui para ser importável
+# sem puxar pandas/requests (caminho de skip do job diário)
+DATA_PROVIDER_VERSION = "BRAPI_QUOTE_HISTORY_v1"
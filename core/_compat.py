@@ -0,0 +1,21 @@
+"""
+Small pandas compatibility helpers shared by the data-path modules.
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+
+def enable_copy_on_write() -> None:
+    """Turn on pandas Copy-on-Write where it is still optional.
+
+    With CoW, ``rename``/``set_axis``/``reset_index`` and slicing return lazy
+    views instead of defensive copies. pandas >= 3 always uses it (and
+    deprecates the option); pandas < 1.5 doesn't have it.
+    """
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return
+    try:
+        pd.set_option("mode.copy_on_write", True)
+    except Exception:
+        pass
@@ -0,0 +1,88 @@
+"""
+Optional numba kernels for the strategy hot path.
+
+``sma_jit`` / ``last_sma_signal_jit`` are ``None`` when numba isn't
+installed; callers fall back to bottleneck / NumPy.
+
+Kernels are compiled eagerly for explicit signatures with ``cache=True``: a
+fresh process loads machine code from ``__pycache__`` instead of paying the
+JIT on its first call. numba is not in requirements.txt; the workflow
+installs it as an optional step and warms the cache with
+``python -m core._fastmath`` before the daily job.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+try:
+    import numba
+    from numba import types
+except ImportError:
+    numba = None
+
+# argument types only (return type inferred); f4 covers FABRICA_DTYPE_DOWNCAST
+if numba is not None:
+    _SMA_SIGS = [(types.float64[:], types.int64), (types.float32[:], types.int64)]
+    _LAST_SIGS = [(types.float64[:], types.int64)]
+
+
+def _sma_loop(x: np.ndarray, w: int) -> np.ndarray:
+    """O(N) streaming SMA with a full-window requirement.
+
+    Keeps a running sum of the non-NaN values and a count of NaNs in the
+    window, so a NaN only blanks the windows that contain it (same as
+    ``rolling(w, min_periods=w).mean()``). The first ``w - 1`` outputs are NaN.
+    """
+    n = x.shape[0]
+    out = np.empty(n, dtype=x.dtype)
+    s = 0.0
+    nans = 0
+    for i in range(n):
+        v = x[i]
+        if np.isnan(v):
+            nans += 1
+        else:
+            s += v
+        if i >= w:
+            old = x[i - w]
+            if np.isnan(old):
+                nans -= 1
+            else:
+                s -= old
+        if i >= w - 1 and nans == 0:
+            out[i] = s / w
+        else:
+            out[i] = np.nan
+    return out
+
+
+# no fastmath (here and below): it assumes no NaNs and would fold away the
+# isnan checks / NaN comparisons
+sma_jit = numba.njit(_SMA_SIGS, cache=True)(_sma_loop) if numba is not None else None
+
+
+def _last_sma_signal_loop(close: np.ndarray, w: int):
+    """``(signal, last_close)`` from the SMA of the last ``w`` closes only.
+
+    Any NaN in the window (or fewer than ``w`` bars) makes the SMA NaN and
+    the signal 0, matching the last row of the full-series computation.
+    """
+    n = close.shape[0]
+    last = close[n - 1]
+    if n < w:
+        return 0, last
+    s = 0.0
+    for i in range(n - w, n):
+        s += close[i]
+    sma = s / w
+    return (1 if last > sma else 0), last
+
+
+last_sma_signal_jit = (
+    numba.njit(_LAST_SIGS, cache=True)(_last_sma_signal_loop) if numba is not None else None
+)
+
+
+if __name__ == "__main__":
+    # importing the module already compiled (or loaded) every signature
+    print("numba kernels:", "cached" if numba is not None else "numba not installed")
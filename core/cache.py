@@ -0,0 +1,289 @@
+"""
+On-disk Parquet cache for provider history fetches.
+
+Every provider call for the same arguments on the same UTC day returns the
+same bars, so results are stored as Parquet files and re-read instead of
+going back to the network. Keys are ``md5(provider|args...|utc_date)`` and
+files live under ``{CACHE_DIR}/{provider}/{key}.parquet``; entries older than
+the provider's TTL are purged once per process.
+
+The cache is best-effort: a missing ``pyarrow`` or an unreadable file simply
+falls through to the wrapped provider.
+
+With ``FABRICA_CACHE_STALE_DAYS=N`` (default 0, off), a provider that returns
+no data is answered from the most recent entry of the previous N days, so a
+provider outage degrades to yesterday's bars instead of a ``NO_DATA`` run.
+
+Providers decorated with ``incremental=True`` (those taking a ``period``) do
+not re-download the full history on the first call of a day: the latest
+earlier entry within the TTL is extended with a short tail fetch (``"5d"``,
+``"1mo"``, ...) covering the days since its last bar. The tail must match
+the cached bars it overlaps (a split/reprint rewrites the whole history), and
+each entry records the day of the full download its chain started from: past
+``FABRICA_CACHE_FULL_REFRESH_DAYS`` (default 5) the history is downloaded in
+full again. ``FABRICA_CACHE_INCREMENTAL=0`` turns this off.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import functools
+import hashlib
+import inspect
+import os
+import time
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.getenv("FABRICA_CACHE_DIR", ".cache")
+CACHE_ENABLED = os.getenv("FABRICA_CACHE", "1") != "0"
+DEFAULT_TTL_DAYS = 7
+STALE_DAYS = int(os.getenv("FABRICA_CACHE_STALE_DAYS", "0"))
+INCREMENTAL = os.getenv("FABRICA_CACHE_INCREMENTAL", "1") != "0"
+FULL_REFRESH_DAYS = int(os.getenv("FABRICA_CACHE_FULL_REFRESH_DAYS", "5"))
+# parquet schema metadata: UTC day of the full download an entry derives from
+_FULL_DAY_META = b"fabrica_full_day"
+# price columns compared between a tail and the cached bars it overlaps
+_CHECK_COLUMNS = ("Open", "High", "Low", "Close", "Adj Close")
+# (calendar days covered, provider period) for the tail fetch, shortest first
+_TAIL_PERIODS = ((5, "5d"), (28, "1mo"), (90, "3mo"), (180, "6mo"), (365, "1y"))
+_PERIOD_UNITS = {"d": 1, "wk": 7, "mo": 30, "y": 365}
+
+_purged: set = set()
+
+
+def _utc_today() -> dt.date:
+    return dt.datetime.now(dt.timezone.utc).date()
+
+
+def make_key(provider: str, *parts, day: Optional[dt.date] = None) -> str:
+    """Build the cache key for a provider call made on ``day`` (UTC).
+
+    Args:
+        provider: Provider name; also the cache subdirectory.
+        *parts: Call arguments that identify the request.
+        day: UTC date of the entry (default today).
+
+    Returns:
+        Relative key of the form ``"{provider}/{md5}"``.
+    """
+    day = day or _utc_today()
+    raw = "|".join([provider, *map(str, parts), day.isoformat()])
+    return f"{provider}/{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def _period_days(period: str) -> Optional[int]:
+    """Calendar days in a period string (``"5d"``, ``"3mo"``, ``"10y"``); ``None`` if open-ended."""
+    p = str(period).strip().lower()
+    for unit, days in _PERIOD_UNITS.items():
+        if p.endswith(unit) and p[: -len(unit)].isdigit():
+            return int(p[: -len(unit)]) * days
+    return None
+
+
+def _tail_period(gap_days: int, period: str) -> Optional[str]:
+    """Shortest tail period covering ``gap_days``, if shorter than ``period``."""
+    full = _period_days(period)
+    for days, tail in _TAIL_PERIODS:
+        if gap_days <= days:
+            return tail if full is None or days < full else None
+    return None
+
+
+def _tail_matches(base: pd.DataFrame, tail: pd.DataFrame) -> bool:
+    """Whether ``tail`` agrees with ``base`` on the bars they share.
+
+    The base's last bar is left out (it may have been a partial session).
+    No other shared bar means nothing to check against: treated as a mismatch.
+    """
+    shared = base.index[:-1].intersection(tail.index)
+    cols = [c for c in _CHECK_COLUMNS if c in base.columns and c in tail.columns]
+    if shared.empty or not cols:
+        return False
+    old = base.loc[shared, cols].to_numpy(dtype=np.float64)
+    new = tail.loc[shared, cols].to_numpy(dtype=np.float64)
+    return bool(np.allclose(old, new, rtol=1e-6, equal_nan=True))
+
+
+def _merge_tail(base: pd.DataFrame, tail: pd.DataFrame, period: str) -> pd.DataFrame:
+    """Append ``tail`` to ``base`` (tail wins on overlap), trimmed to ``period``."""
+    merged = pd.concat([base, tail])
+    merged = merged[~merged.index.duplicated(keep="last")].sort_index(kind="mergesort")
+    full = _period_days(period)
+    if full is not None:
+        merged = merged[merged.index >= merged.index[-1] - pd.Timedelta(days=full)]
+    return merged
+
+
+def _path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+
+def full_day(key: str) -> Optional[dt.date]:
+    """UTC day of the full download behind ``key``'s entry (``None`` if unknown)."""
+    try:
+        import pyarrow.parquet as pq  # type: ignore
+
+        meta = pq.read_schema(_path(key)).metadata or {}
+        return dt.date.fromisoformat(meta[_FULL_DAY_META].decode())
+    except Exception:
+        return None
+
+
+def get(key: str) -> Optional[pd.DataFrame]:
+    """Return the cached frame for ``key``, or ``None`` on a miss."""
+    path = _path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        import pyarrow.parquet as pq  # type: ignore
+
+        return pq.read_table(path).to_pandas()
+    except Exception:
+        return None
+
+
+def put(key: str, df: pd.DataFrame, full: Optional[dt.date] = None) -> None:
+    """Store ``df`` under ``key`` (atomic rename, zstd-compressed).
+
+    ``full`` is the day of the full download the frame derives from (default
+    today, i.e. ``df`` is a full download); incremental entries pass their
+    base's day along.
+    """
+    path = _path(key)
+    try:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.parquet as pq  # type: ignore
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        table = pa.Table.from_pandas(df)
+        meta = dict(table.schema.metadata or {})
+        meta[_FULL_DAY_META] = (full or _utc_today()).isoformat().encode()
+        pq.write_table(table.replace_schema_metadata(meta), tmp, compression="zstd")
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def purge(provider: str, ttl_days: float = DEFAULT_TTL_DAYS) -> None:
+    """Delete a provider's entries older than ``ttl_days`` (once per process)."""
+    if provider in _purged:
+        return
+    _purged.add(provider)
+    folder = os.path.join(CACHE_DIR, provider)
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - ttl_days * 86400
+    for name in os.listdir(folder):
+        p = os.path.join(folder, name)
+        try:
+            if os.path.getmtime(p) < cutoff:
+                os.remove(p)
+        except OSError:
+            pass
+
+
+def cached(provider: str, ttl_days: float = DEFAULT_TTL_DAYS, incremental: bool = False) -> Callable:
+    """Decorate a ``fetch_history_*`` function with the Parquet cache.
+
+    The key is built from the provider name, the call's positional arguments
+    and its sorted keyword arguments, and is exposed as ``fn.cache_key`` so
+    batch fetchers can read/write the same entries. Empty results are never
+    cached, so a transient provider failure is retried on the next call; with
+    ``STALE_DAYS`` set they fall back to the latest earlier entry.
+
+    Args:
+        provider: Provider name (cache subdirectory).
+        ttl_days: Age after which this provider's files are purged.
+        incremental: On a miss, extend the latest earlier entry with a tail
+            fetch instead of downloading the whole ``period`` (the wrapped
+            function must take a ``period`` argument).
+
+    Returns:
+        Decorator preserving the wrapped function's signature.
+    """
+
+    def deco(fn: Callable) -> Callable:
+        def key_on(day: Optional[dt.date], args: tuple, kwargs: dict) -> str:
+            return make_key(provider, *args, *(f"{k}={v}" for k, v in sorted(kwargs.items())), day=day)
+
+        def cache_key(*args, **kwargs) -> str:
+            return key_on(None, args, kwargs)
+
+        def latest_stale(args: tuple, kwargs: dict) -> Optional[pd.DataFrame]:
+            today = _utc_today()
+            for back in range(1, STALE_DAYS + 1):
+                df = get(key_on(today - dt.timedelta(days=back), args, kwargs))
+                if df is not None:
+                    print(f"[WARN] {fn.__name__}{args}: no fresh data, using cache from {back}d ago")
+                    return df
+            return None
+
+        sig = inspect.signature(fn)
+
+        def fetch_incremental(args: tuple, kwargs: dict) -> Optional[pd.DataFrame]:
+            """Today's entry from the latest earlier one + a tail (stored); ``None``: do a full fetch."""
+            today = _utc_today()
+            for back in range(1, int(ttl_days) + 1):
+                base_key = key_on(today - dt.timedelta(days=back), args, kwargs)
+                base = get(base_key)
+                if base is None:
+                    continue
+                if base.empty or not isinstance(base.index, pd.DatetimeIndex):
+                    return None
+                base_full = full_day(base_key)
+                if base_full is None or (today - base_full).days > FULL_REFRESH_DAYS:
+                    return None
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                period = bound.arguments["period"]
+                tail_period = _tail_period((today - base.index[-1].date()).days, period)
+                if tail_period is None:
+                    return None
+                bound.arguments["period"] = tail_period
+                tail = fn(*bound.args, **bound.kwargs)
+                if tail is None or tail.empty or not _tail_matches(base, tail):
+                    # no tail, or the provider rewrote history (split, reprint)
+                    return None
+                merged = _merge_tail(base, tail, period)
+                put(key_on(today, args, kwargs), merged, full=base_full)
+                return merged
+            return None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return fn(*args, **kwargs)
+            purge(provider, ttl_days)
+            key = cache_key(*args, **kwargs)
+            df = get(key)
+            if df is not None:
+                return df
+            if incremental and INCREMENTAL:
+                try:
+                    df = fetch_incremental(args, kwargs)
+                except Exception:
+                    # bad base entry / provider hiccup: do the full fetch
+                    df = None
+                if df is not None:
+                    return df
+            df = fn(*args, **kwargs)
+            if df is not None and not df.empty:
+                put(key, df)
+            elif STALE_DAYS > 0:
+                stale = latest_stale(args, kwargs)
+                if stale is not None:
+                    return stale
+            return df
+
+        # batch callers (e.g. multi-ticker downloads) share the same entries
+        wrapper.cache_key = cache_key
+        wrapper.stale_entry = lambda *args, **kwargs: latest_stale(args, kwargs)
+        wrapper.incremental_entry = lambda *args, **kwargs: (
+            fetch_incremental(args, kwargs) if incremental and INCREMENTAL else None
+        )
+        return wrapper
+
+    return deco
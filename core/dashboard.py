@@ -0,0 +1,303 @@
+"""
+Dashboard Streamlit do sistema de tendência.
+
+Helpers de leitura (events.log / state.json, com cache) e a renderização
+ficam aqui; ``app.py`` só chama ``render_dashboard()``.
+"""
+import json
+import os
+
+import streamlit as st
+
+from core.storage import LOG_FILE, STATE_DIR, STATE_FILE, load_events_tail, load_state
+
+try:
+    import orjson  # parser bem mais rápido para o events.log
+except ImportError:
+    orjson = None
+
+TAIL_CHUNK = 64 * 1024
+EVENTS_TAIL = 500  # quantos eventos o audit trail mostra
+# "type":"RUN" como sai do orjson e do json stdlib (com espaço)
+RUN_TAGS = (b'"type":"RUN"', b'"type": "RUN"')
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def _json_loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _file_stamp(path: str):
+    """(mtime_ns, size) do arquivo; muda sempre que o job grava algo."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+
+@st.cache_data(show_spinner=False)
+def _recent_events_cached(log_file: str, stamp, n: int):
+    return load_events_tail(n, log_file)
+
+
+def load_recent_events(log_file: str, n: int = EVENTS_TAIL):
+    # mmap + índice lateral: custo ~ n eventos, não o log inteiro
+    return _recent_events_cached(log_file, _file_stamp(log_file), n)
+
+
+@st.cache_data(show_spinner=False)
+def _load_state_cached(stamp):
+    return load_state()
+
+
+def load_state_cached():
+    return _load_state_cached(_file_stamp(STATE_FILE))
+
+
+def _parse_run_line(line: bytes):
+    # filtro barato em bytes (memchr/memmem) antes de pagar o parse do JSON
+    if RUN_TAGS[0] not in line and RUN_TAGS[1] not in line:
+        return None
+    try:
+        ev = _json_loads(line)
+    except ValueError:
+        return None
+    if isinstance(ev, dict) and ev.get("type") == "RUN":
+        return ev
+    return None
+
+
+def _tail_last_run(log_file: str):
+    """
+    Acha o último RUN lendo o log de trás pra frente em blocos de TAIL_CHUNK.
+    Para no primeiro match: custo ~ tamanho do último registro, não do arquivo.
+    """
+    try:
+        f = open(log_file, "rb")
+    except OSError:
+        return None
+
+    with f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        carry = b""
+        while pos > 0:
+            step = min(TAIL_CHUNK, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + carry).split(b"\n")
+            # a primeira linha do bloco pode estar cortada; guarda pro próximo
+            carry = lines.pop(0) if pos > 0 else b""
+            for line in reversed(lines):
+                ev = _parse_run_line(line)
+                if ev is not None:
+                    return ev
+    return None
+
+
+@st.cache_data(show_spinner=False)
+def _last_run_cached(log_file: str, stamp):
+    return _tail_last_run(log_file)
+
+
+def load_last_run(log_file: str):
+    return _last_run_cached(log_file, _file_stamp(log_file))
+
+
+def events_table(events):
+    """
+    Audit trail pronto pro st.dataframe (ts desc), colunas aninhadas achatadas
+    ("trend.window", "signals.BOVA11", ...).
+    Monta direto uma pyarrow.Table (builder colunar, sem passar por pandas);
+    json_normalize fica de fallback.
+    """
+    try:
+        import pyarrow as pa
+
+        tbl = pa.Table.from_struct_array(pa.array(events))
+        while any(pa.types.is_struct(f.type) for f in tbl.schema):
+            tbl = tbl.flatten()
+        if "ts" in tbl.column_names:
+            tbl = tbl.sort_by([("ts", "descending")])
+        return tbl
+    except Exception:
+        # pyarrow ausente ou tipos conflitantes entre eventos
+        import pandas as pd
+
+        logdf = pd.json_normalize(events)
+        # ordena desc por ts se existir
+        if "ts" in logdf.columns:
+            logdf = logdf.sort_values("ts", ascending=False)
+        return logdf
+
+
+@st.cache_data(show_spinner=False)
+def _events_table_cached(log_file: str, stamp):
+    return events_table(_recent_events_cached(log_file, stamp, EVENTS_TAIL))
+
+
+def load_events_table(log_file: str):
+    return _events_table_cached(log_file, _file_stamp(log_file))
+
+
+# (campo do RUN, chave do state, só sobrescreve se o valor atual estiver em)
+_RUN_FLOAT_FIELDS = (
+    ("equity", "equity", (None, 0, 100000.0)),
+    ("peak_equity", "peak_equity", None),
+    ("drawdown", "last_drawdown", None),
+    ("portfolio_return", "last_portfolio_return", (None,)),
+)
+
+
+def _coerce_float(d: dict, key: str):
+    """float(d[key]) ou None se ausente/inválido."""
+    if key not in d:
+        return None
+    try:
+        return float(d[key])
+    except (TypeError, ValueError):
+        return None
+
+
+def state_from_last_run(state: dict, run_ev: dict):
+    """Se state estiver incompleto, completa com info do último RUN."""
+    if not run_ev:
+        return state
+
+    # positions
+    if not state.get("positions"):
+        w = run_ev.get("weights", {}) or {}
+        state["positions"] = {t: {"state": 1 if float(p) > 0 else 0, "weight": float(p)} for t, p in w.items()}
+
+    # equity / peak / drawdown / return
+    for src, dst, only_if in _RUN_FLOAT_FIELDS:
+        if only_if is not None and state.get(dst) not in only_if:
+            continue
+        v = _coerce_float(run_ev, src)
+        if v is not None:
+            state[dst] = v
+
+    # kill switch
+    if "kill_switch" in run_ev:
+        state["kill_switch"] = bool(run_ev["kill_switch"])
+
+    # last run timestamp
+    if state.get("last_run") is None and "ts" in run_ev:
+        state["last_run"] = run_ev.get("ts")
+
+    return state
+
+
+def health_label(state: dict, run_ev: dict, events: list):
+    """
+    Health simples e objetivo:
+    - STOPPED: kill_switch
+    - DEGRADED: sem RUN recente / sem positions / sem prices no último run
+    - OK: tem RUN + positions + weights
+    """
+    if state.get("kill_switch"):
+        return "STOPPED"
+
+    has_run = bool(events) and bool(run_ev)
+    has_positions = bool(state.get("positions"))
+    has_weights = has_run and bool(run_ev.get("weights"))
+    return "OK" if (has_run and has_positions and has_weights) else "DEGRADED"
+
+
+# ----------------------------
+# UI
+# ----------------------------
+def render_dashboard():
+    st.set_page_config(page_title="Sistema Autônomo de Tendência", layout="wide")
+
+    st.title("Sistema Autônomo Baseado em Tendência (Price-Based)")
+    st.caption("Preço decide. Regra executa. Stop manda. Humano observa.")
+
+    with st.expander("Debug (remover depois)", expanded=False):
+        st.write("LOG_FILE:", LOG_FILE)
+        st.write("STATE_DIR exists:", os.path.exists(STATE_DIR))
+
+    state = load_state_cached()
+    events = load_recent_events(LOG_FILE)
+    run_ev = load_last_run(LOG_FILE)
+    state = state_from_last_run(state, run_ev)
+
+    status = health_label(state, run_ev, events)
+
+    # KPIs
+    c1, c2, c3, c4, c5 = st.columns(5)
+
+    equity = float(state.get("equity", 100000.0))
+    peak = float(state.get("peak_equity", equity))
+    dd = float(state.get("last_drawdown", 0.0))
+    ret = float(state.get("last_portfolio_return", 0.0) or 0.0)
+
+    c1.metric("Equity", f"{equity:,.2f}")
+    c2.metric("Peak Equity", f"{peak:,.2f}")
+    c3.metric("Drawdown", f"{dd*100:.2f}%")
+    c4.metric("Retorno do dia", f"{ret*100:.2f}%")
+    c5.metric("Health", status)
+
+    st.divider()
+
+    # Last run
+    st.subheader("Último Run")
+    if run_ev:
+        st.write(f"**Timestamp (log):** {run_ev.get('ts')}")
+        st.write(f"**Kill Switch:** {'ON' if bool(run_ev.get('kill_switch')) else 'OFF'}")
+    else:
+        st.warning("Ainda não há evento RUN no log.")
+
+    st.divider()
+
+    # Positions
+    st.subheader("Posições (Estado / Peso)")
+    pos = state.get("positions", {}) or {}
+    if pos:
+        import pandas as pd  # lazy: só paga o import quando há o que renderizar
+
+        df = pd.DataFrame.from_dict(pos, orient="index")
+        df.index.name = "Ticker"
+        df = df.sort_values(["state", "weight"], ascending=[False, False])
+        st.dataframe(df, use_container_width=True)
+    else:
+        st.info("Sem posições registradas ainda. Execute o job diário.")
+
+    st.divider()
+
+    # Signals/Weights of last run (clean view)
+    st.subheader("Sinais e Pesos (Último Run)")
+    if run_ev:
+        sig = run_ev.get("signals", {}) or {}
+        w = run_ev.get("weights", {}) or {}
+        px = run_ev.get("prices", {}) or {}
+
+        view = []
+        tickers = sorted(set(list(sig.keys()) + list(w.keys()) + list(px.keys())))
+        for t in tickers:
+            view.append({
+                "ticker": t,
+                "signal": sig.get(t),
+                "weight": w.get(t),
+                "price": px.get(t),
+            })
+
+        # st.dataframe aceita list[dict] direto; não precisa de DataFrame
+        st.dataframe(view, use_container_width=True)
+    else:
+        st.info("Sem RUN ainda.")
+
+    st.divider()
+
+    # Events table
+    st.subheader("Eventos (Audit Trail)")
+    st.caption(f"Últimos {EVENTS_TAIL} eventos do log.")
+    if events:
+        st.dataframe(load_events_table(LOG_FILE), use_container_width=True)
+    else:
+        st.warning("Ainda não há log. Execute o job diário para começar a trilha.")
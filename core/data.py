@@ -1,12 +1,23 @@
 # DATA_PROVIDER_VERSION = "BRAPI_QUOTE_HISTORY_v1"
 
 import os
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 import requests
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core import DATA_PROVIDER_VERSION  # noqa: F401  (re-export)
+from core.cache import cached
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
-DATA_PROVIDER_VERSION = "BRAPI_QUOTE_HISTORY_v1"
 BRAPI_BASE_URL = os.getenv("BRAPI_BASE_URL", "https://brapi.dev/api")
 BRAPI_TOKEN = os.getenv("BRAPI_TOKEN", "").strip()
 
@@ -14,72 +25,139 @@ BRAPI_TOKEN = os.getenv("BRAPI_TOKEN", "").strip()
 def _headers():
     # docs recomendam Authorization: Bearer <token>
     # (se não tiver token, tenta mesmo assim; alguns ativos exigem token)
+    # BRAPI_TOKEN é lido no import: montado uma vez só, na criação da session
     h = {"User-Agent": "trend-system/1.0"}
     if BRAPI_TOKEN:
         h["Authorization"] = f"Bearer {BRAPI_TOKEN}"
     return h
 
 
+def _make_session() -> requests.Session:
+    """
+    Session compartilhada: keep-alive + pool de conexões (evita handshake
+    TCP/TLS por ticker) e retry com backoff para 429/5xx e falhas de conexão.
+    """
+    retry = Retry(
+        total=3,
+        backoff_factor=1.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update(_headers())
+    return s
+
+
+_SESSION = _make_session()
+
+
 def _parse_hist(hlist):
     """
     historicalDataPrice costuma vir como lista de candles com campos tipo:
     date (epoch), open, high, low, close, volume
+
+    Coleta as colunas numa passada, converte cada uma para numpy de uma vez
+    e constrói o DataFrame com um único pd.to_datetime vetorizado.
     """
     if not isinstance(hlist, list) or not hlist:
         return pd.DataFrame()
 
-    rows = []
+    # date pode vir em epoch (segundos) ou ms: decide uma vez pela amostra,
+    # em vez de testar linha a linha
+    divisor = 1
+    for x in hlist:
+        if isinstance(x, dict):
+            sample = x.get("date") or x.get("datetime") or x.get("timestamp")
+            try:
+                divisor = 1000 if int(sample) > 10_000_000_000 else 1
+                break
+            except (TypeError, ValueError):
+                continue
+
+    # loop só coleta valores crus; conversão/limpeza é vetorizada por coluna
+    dates, raw_o, raw_h, raw_l, raw_c, raw_v = [], [], [], [], [], []
+    parsed = {}  # posições com data em string (já em segundos)
     for x in hlist:
         if not isinstance(x, dict):
             continue
 
         d = x.get("date") or x.get("datetime") or x.get("timestamp")
-        o = x.get("open")
-        h = x.get("high")
-        l = x.get("low")
-        c = x.get("close")
-        v = x.get("volume", 0)
-
-        if d is None or c is None:
+        cl = x.get("close")
+        if d is None or cl is None:
             continue
 
-        # date pode vir em epoch (segundos) ou ms
         try:
-            d = int(d)
-            if d > 10_000_000_000:  # ms
-                d = d / 1000
-            dt_index = pd.to_datetime(d, unit="s", utc=True).tz_convert(None)
-        except Exception:
+            dates.append(int(d))
+        except (TypeError, ValueError):
             # fallback: tenta parse como string
-            dt_index = pd.to_datetime(d, errors="coerce")
-            if pd.isna(dt_index):
+            ts = pd.to_datetime(d, errors="coerce")
+            if pd.isna(ts):
                 continue
+            parsed[len(dates)] = ts.value // 1_000_000_000
+            dates.append(0)
 
-        rows.append({
-            "Date": dt_index,
-            "Open": float(o) if o is not None else None,
-            "High": float(h) if h is not None else None,
-            "Low": float(l) if l is not None else None,
-            "Close": float(c) if c is not None else None,
-            "Volume": float(v) if v is not None else 0.0,
-        })
+        raw_o.append(x.get("open"))
+        raw_h.append(x.get("high"))
+        raw_l.append(x.get("low"))
+        raw_c.append(cl)
+        raw_v.append(x.get("volume"))
 
-    if not rows:
+    if not dates:
         return pd.DataFrame()
 
-    df = pd.DataFrame(rows).dropna(subset=["Date", "Close"])
-    df = df.set_index("Date").sort_index()
+    dates = np.array(dates, dtype=np.int64)
+    if divisor != 1:
+        dates //= divisor
+    for i, sec in parsed.items():
+        dates[i] = sec
+
+    # dtype float converte None -> NaN numa passada; volume ausente vira 0
+    cols = {
+        "Open": np.array(raw_o, dtype=np.float64),
+        "High": np.array(raw_h, dtype=np.float64),
+        "Low": np.array(raw_l, dtype=np.float64),
+        "Close": np.array(raw_c, dtype=np.float64),
+        "Volume": np.array(raw_v, dtype=np.float64),
+    }
+    cols["Volume"][np.isnan(cols["Volume"])] = 0.0
+
+    # ordena (estável; candles já costumam vir em ordem) e descarta Close NaN
+    # direto nos arrays, em vez de sort_index() + dropna() copiando o frame
+    keep = ~np.isnan(cols["Close"])
+    if len(dates) > 1 and not (dates[1:] >= dates[:-1]).all():
+        order = np.argsort(dates, kind="stable")
+        sel = order[keep[order]]
+    elif not keep.all():
+        sel = np.flatnonzero(keep)
+    else:
+        sel = None
+    if sel is not None:
+        dates = dates[sel]
+        cols = {k: v[sel] for k, v in cols.items()}
+
+    index = pd.DatetimeIndex(pd.to_datetime(dates, unit="s"), name="Date")
+    return pd.DataFrame(cols, index=index)
 
-    # garante colunas
-    for col in ["Open", "High", "Low", "Close", "Volume"]:
-        if col not in df.columns:
-            df[col] = None
 
-    df = df[["Open", "High", "Low", "Close", "Volume"]].dropna(subset=["Close"])
-    return df
+def fetch_history(ticker: str, period="10y", interval="1d") -> pd.DataFrame:
+    """
+    Igual a _fetch_history_brapi, mas com cache em parquet do dia (core.cache):
+    a 2ª chamada do dia para o mesmo (ticker, range, interval) não vai à rede.
+    """
+    t = ticker.strip().upper()
+    if not t:
+        return pd.DataFrame()
 
+    rng = period if period and isinstance(period, str) else os.getenv("BRAPI_RANGE", "10y")
+    itv = interval if interval and isinstance(interval, str) else os.getenv("BRAPI_INTERVAL", "1d")
+    return _fetch_history_brapi(t, rng, itv)
 
-def fetch_history(ticker: str, period="10y", interval="1d") -> pd.DataFrame:
+
+@cached("brapi", incremental=True)
+def _fetch_history_brapi(ticker: str, period="10y", interval="1d") -> pd.DataFrame:
     """
     BRAPI:
       GET /api/quote/{tickers}?range=10y&interval=1d
@@ -107,24 +185,33 @@ def fetch_history(ticker: str, period="10y", interval="1d") -> pd.DataFrame:
         # se quiser, dá pra passar token por query (menos recomendado)
         pass
 
-    # retry simples (robustez em CI)
-    last_err = None
-    for _ in range(3):
-        try:
-            r = requests.get(url, headers=_headers(), params=params, timeout=30)
-            if r.status_code == 429:
-                time.sleep(2)
-                continue
-            r.raise_for_status()
-            data = r.json()
-            results = data.get("results") or []
-            if not results:
-                return pd.DataFrame()
-            hist = results[0].get("historicalDataPrice") or []
-            return _parse_hist(hist)
-        except Exception as e:
-            last_err = e
-            time.sleep(1)
-
-    # falhou de vez
-    return pd.DataFrame()
+    # retry/backoff ficam no adapter da session (_make_session)
+    try:
+        r = _SESSION.get(url, params=params, timeout=30)
+        r.raise_for_status()
+        # orjson decodifica direto dos bytes, bem mais rápido que r.json()
+        data = orjson.loads(r.content) if orjson is not None else r.json()
+        results = data.get("results") or []
+        if not results:
+            return pd.DataFrame()
+        hist = results[0].get("historicalDataPrice") or []
+        return _parse_hist(hist)
+    except Exception:
+        # falhou de vez
+        return pd.DataFrame()
+
+
+def fetch_history_many(tickers, period="10y", interval="1d", max_workers=8) -> dict:
+    """
+    Busca vários tickers em paralelo. Cada chamada é I/O de rede (BRAPI),
+    então threads dão ganho ~linear até max_workers.
+
+    Retorna {ticker: DataFrame} (DataFrame vazio quando não houver dados).
+    """
+    tickers = [t for t in dict.fromkeys(tickers) if t]
+    if not tickers:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tickers))) as ex:
+        futs = {ex.submit(fetch_history, t, period, interval): t for t in tickers}
+        return {futs[f]: f.result() for f in as_completed(futs)}
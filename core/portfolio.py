@@ -1,11 +1,17 @@
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
+
+import numpy as np
 
 def compute_weights(signals: Dict[str, int]) -> Dict[str, float]:
-    on = [t for t, s in signals.items() if s == 1]
-    if len(on) == 0:
-        return {t: 0.0 for t in signals.keys()}
-    w = 1.0 / len(on)
-    return {t: (w if signals[t] == 1 else 0.0) for t in signals.keys()}
+    """
+    Equal-weight entre os ativos ON (máscara numpy em vez de loop em dict).
+    """
+    keys = list(signals)
+    arr = np.fromiter(signals.values(), dtype=np.int8, count=len(keys))
+    on = arr == 1
+    n_on = int(on.sum())
+    w = np.where(on, 1.0 / n_on, 0.0) if n_on else np.zeros(len(keys))
+    return dict(zip(keys, w.tolist()))
 
 def update_kill_switch(equity: float, peak_equity: float, max_dd: float) -> Tuple[bool, float, float]:
     """
@@ -23,13 +29,65 @@ def diff_states(prev_positions: Dict[str, dict], new_weights: Dict[str, float])
       OFF->ON = ENTER
       ON->OFF = EXIT
     """
-    orders = []
-    for ticker, w in new_weights.items():
-        prev_state = int(prev_positions.get(ticker, {}).get("state", 0))
-        new_state = 1 if w > 0 else 0
+    tickers = list(new_weights)
+    n = len(tickers)
+    prev = np.fromiter(
+        (int(prev_positions.get(t, {}).get("state", 0)) for t in tickers), dtype=np.int8, count=n
+    )
+    new = (np.fromiter(new_weights.values(), dtype=np.float64, count=n) > 0).astype(np.int8)
+
+    enter = (prev == 0) & (new == 1)
+    exit_ = (prev == 1) & (new == 0)
+    return [
+        {"ticker": tickers[i], "action": "ENTER" if enter[i] else "EXIT"}
+        for i in np.flatnonzero(enter | exit_)
+    ]
+
+
+def extract_prev_weights(positions: Optional[Dict[str, dict]]) -> Dict[str, float]:
+    """
+    Pesos da execução anterior a partir de state["positions"] ({t: {state, weight}}).
+    """
+    return {t: float(p.get("weight", 0.0)) for t, p in (positions or {}).items()}
+
+
+def mark_to_market(
+    prev_weights: Dict[str, float],
+    prev_prices: Dict[str, float],
+    prices: Dict[str, float],
+    details: bool = False,
+) -> Tuple[float, Optional[Dict[str, dict]]]:
+    """
+    Retorno da carteira entre a execução anterior e hoje:
+      port_ret = sum(w * (p1/p0 - 1)) nos ativos com peso > 0 e os dois preços válidos.
+    Os tickers com peso e preço nos dois dias são separados de uma vez
+    (sem .get/NaN por ticker); a conta é um np.dot. Ativos sem preço contam 0
+    (ver missing_prices). O detalhe por ticker ({t: {weight, p0, p1, ret}})
+    só é montado com details=True.
+    """
+    shared = [t for t, w in prev_weights.items() if w > 0 and t in prev_prices and t in prices]
+    n = len(shared)
+    if n == 0:
+        return 0.0, ({} if details else None)
+    w = np.fromiter((prev_weights[t] for t in shared), dtype=np.float64, count=n)
+    p0 = np.fromiter((prev_prices[t] for t in shared), dtype=np.float64, count=n)
+    p1 = np.fromiter((prices[t] for t in shared), dtype=np.float64, count=n)
+
+    mask = np.isfinite(p0) & np.isfinite(p1) & (p0 > 0)
+    rets = p1[mask] / p0[mask] - 1.0
+    port_ret = float(np.dot(w[mask], rets))
+    if not details:
+        return port_ret, None
+    used = {
+        shared[i]: {"weight": float(w[i]), "p0": float(p0[i]), "p1": float(p1[i]), "ret": float(r)}
+        for i, r in zip(np.flatnonzero(mask), rets.tolist())
+    }
+    return port_ret, used
+
 
-        if prev_state == 0 and new_state == 1:
-            orders.append({"ticker": ticker, "action": "ENTER"})
-        elif prev_state == 1 and new_state == 0:
-            orders.append({"ticker": ticker, "action": "EXIT"})
-    return orders
+def missing_prices(
+    prev_weights: Dict[str, float], prev_prices: Dict[str, float], prices: Dict[str, float]
+) -> List[str]:
+    """Ativos com peso > 0 sem preço anterior ou de hoje (ficam fora do M2M)."""
+    held = {t for t, w in prev_weights.items() if w > 0}
+    return sorted(held - (prev_prices.keys() & prices.keys()))
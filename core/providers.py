@@ -7,20 +7,106 @@ appropriate provider for each asset when ``run_daily.py`` requests data.
 
 Providers currently implemented:
 
-* Yahoo Finance for Brazilian ETFs (B3) via yfinance
+* Yahoo Finance for Brazilian ETFs (B3) via yfinance (single or batched)
 * BRAPI wrapper for equities (stocks) on B3 (delegates to existing core.data)
 * A simple FX provider using exchangerate.host for currency pairs
 
+Network-backed providers are wrapped with ``core.cache.cached`` so repeated
+requests on the same UTC day are served from the on-disk Parquet cache.
+
 Note: Additional providers can be added here and wired into ``core.router``.
 """
 from __future__ import annotations
 
+import atexit
 import datetime as dt
-from typing import Tuple, Optional, Dict, Any
+import functools
+import os
+import random
+import time
+from typing import Tuple, Optional, Dict, Any, List
 
+import numpy as np
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from core import cache
+from core._compat import enable_copy_on_write
+from core.cache import cached
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+enable_copy_on_write()
+
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "1.0"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "32.0"))
+YAHOO_TIMEOUT = 20  # seconds per yf.download request
+DTYPE_DOWNCAST = os.getenv("FABRICA_DTYPE_DOWNCAST", "0") == "1"
+
+PRICE_COLUMNS = ("Open", "High", "Low", "Close", "Adj Close")
+OHLCV_COLUMNS = ("Open", "High", "Low", "Close", "Adj Close", "Volume")
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def _make_fx_session() -> requests.Session:
+    """Pooled keep-alive session for the FX API (one TLS handshake per host).
+
+    No adapter-level retries: requests go through ``_with_retry``.
+    """
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.headers.update({"User-Agent": "trend-system/1.0"})
+    return s
+
+
+_FX_SESSION = _make_fx_session()
+atexit.register(_FX_SESSION.close)
+
+
+def _transient_errors() -> Tuple[type, ...]:
+    """Exception types worth retrying (network hiccups and rate limits)."""
+    errors: List[type] = [requests.ConnectionError, requests.Timeout]
+    try:
+        from yfinance.exceptions import YFRateLimitError  # type: ignore
+
+        errors.append(YFRateLimitError)
+    except Exception:
+        pass
+    return tuple(errors)
 
 
+def _with_retry(fn, *args, **kwargs):
+    """Call ``fn`` retrying transient errors with exponential backoff + jitter.
+
+    Sleeps ``uniform(0, min(base * 2**attempt, cap))`` between attempts
+    ("full jitter"), so concurrent workers don't retry in lockstep. Any
+    other exception (bad symbol, HTTP 4xx, parse errors) is raised at once.
+
+    Args:
+        fn: Callable performing the request.
+        *args: Positional arguments for ``fn``.
+        **kwargs: Keyword arguments for ``fn``.
+
+    Returns:
+        Whatever ``fn`` returns.
+    """
+    transient = _transient_errors()
+    for attempt in range(max(MAX_RETRIES, 1)):
+        try:
+            return fn(*args, **kwargs)
+        except transient:
+            if attempt >= MAX_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0, min(RETRY_BACKOFF_BASE * 2**attempt, RETRY_BACKOFF_MAX)))
+
+
+@functools.lru_cache(maxsize=4096)
 def _normalize_yahoo_symbol(ticker: str, market: str) -> str:
     """Normalize a B3 ticker for Yahoo Finance.
 
@@ -41,13 +127,71 @@ def _normalize_yahoo_symbol(ticker: str, market: str) -> str:
     return t
 
 
+def _normalize_ohlcv(df: pd.DataFrame) -> pd.DataFrame:
+    """Bring a raw yfinance frame to the provider column convention.
+
+    Flattens MultiIndex columns (recent yfinance versions return
+    ``(Price, Ticker)`` even for a single symbol), keeps yfinance's
+    DatetimeIndex (named ``Datetime``) instead of moving it into a column, so
+    ``core.strategy`` takes its indexed fast path, sorts ascending and keeps
+    only the OHLCV columns.
+
+    Args:
+        df: Frame as returned by ``yf.download`` for one symbol.
+
+    Returns:
+        Normalized DataFrame. May be empty.
+    """
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.set_axis(df.columns.get_level_values(0), axis=1)
+
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df = df.set_axis(pd.to_datetime(df.index, errors="coerce"), axis=0)
+    df = df.rename_axis("Datetime")
+
+    # Sort ascending by datetime (yfinance already returns sorted bars)
+    if not df.index.is_monotonic_increasing:
+        # mergesort: stable and fast on nearly-sorted input
+        df = df.sort_index(kind="mergesort")
+    # Keep only relevant columns if others exist (one set build, O(1) checks)
+    present = set(df.columns)
+    cols = [c for c in OHLCV_COLUMNS if c in present]
+    return df if len(cols) == len(present) and cols == list(df.columns) else df[cols]
+
+
+def downcast_ohlcv(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink OHLCV dtypes to float32 prices and int32 volume.
+
+    Only active when ``FABRICA_DTYPE_DOWNCAST=1``. Volume stays float32
+    instead of int32 when it has NaNs or values beyond the int32 range.
+
+    Args:
+        df: Normalized OHLCV frame from any provider.
+
+    Returns:
+        Frame with narrowed dtypes (the input itself when disabled/empty).
+    """
+    if not DTYPE_DOWNCAST or df is None or df.empty:
+        return df
+    dtypes = {c: "float32" for c in PRICE_COLUMNS if c in df.columns}
+    if "Volume" in df.columns:
+        vol = df["Volume"].to_numpy(dtype=np.float64)
+        fits = not np.isnan(vol).any() and np.abs(vol).max() <= INT32_MAX
+        dtypes["Volume"] = "int32" if fits else "float32"
+    return df.astype(dtypes)
+
+
+@cached("yahoo", incremental=True)
 def fetch_history_yahoo(ticker: str, market: str, period: str = "10y", interval: str = "1d") -> pd.DataFrame:
     """Fetch historical OHLC data from Yahoo Finance.
 
     This uses the ``yfinance`` package to download data. If no data is
-    available it returns an empty DataFrame. Columns are renamed to follow a
-    consistent convention (``Datetime``, ``Open``, ``High``, ``Low``, ``Close``,
-    ``Adj Close``, ``Volume``) and sorted in ascending order by date.
+    available it returns an empty DataFrame. The frame is indexed by a
+    ``Datetime`` DatetimeIndex with ``Open``, ``High``, ``Low``, ``Close``,
+    ``Adj Close``, ``Volume`` columns, sorted in ascending order by date.
 
     Args:
         ticker: Raw ticker symbol (e.g. ``BOVA11``).
@@ -61,34 +205,100 @@ def fetch_history_yahoo(ticker: str, market: str, period: str = "10y", interval:
     import yfinance as yf  # type: ignore  # Local import to avoid hard dependency when unused
 
     sym = _normalize_yahoo_symbol(ticker, market)
-    df = yf.download(sym, period=period, interval=interval, auto_adjust=False, progress=False)
+    df = _with_retry(
+        yf.download, sym, period=period, interval=interval, auto_adjust=False, progress=False, timeout=YAHOO_TIMEOUT
+    )
+    return _normalize_ohlcv(df)
 
-    if df is None or df.empty:
-        return pd.DataFrame()
 
-    df = df.reset_index()
-    # Standardize column names
-    if "Date" in df.columns:
-        df.rename(columns={"Date": "Datetime"}, inplace=True)
-    elif "Datetime" not in df.columns and "Date" not in df.columns:
-        df.insert(0, "Datetime", pd.to_datetime(df.index))
-
-    df.rename(
-        columns={
-            "Open": "Open",
-            "High": "High",
-            "Low": "Low",
-            "Close": "Close",
-            "Adj Close": "Adj Close",
-            "Volume": "Volume",
-        },
-        inplace=True,
-    )
-    # Sort ascending by datetime
-    df = df.sort_values("Datetime").reset_index(drop=True)
-    # Keep only relevant columns if others exist
-    cols = [c for c in ["Datetime", "Open", "High", "Low", "Close", "Adj Close", "Volume"] if c in df.columns]
-    return df[cols]
+def fetch_history_yahoo_many(
+    tickers: List[str], market: str, period: str = "10y", interval: str = "1d"
+) -> Dict[str, pd.DataFrame]:
+    """Fetch several symbols from Yahoo Finance in a single download.
+
+    Cached symbols (same entries as ``fetch_history_yahoo``) are served from
+    disk, symbols with an earlier entry are topped up with a short tail
+    download; the remaining ones go out in one ``yf.download([...])`` request and
+    the multi-ticker frame is split per symbol. Symbols that failed inside an
+    otherwise successful batch are retried with a single-ticker download; if
+    the batch request itself raises, every missed symbol takes that path.
+
+    Args:
+        tickers: Raw ticker symbols.
+        market: Market code shared by all tickers (e.g. ``B3``).
+        period: Duration to fetch (e.g. ``"10y"``).
+        interval: Sampling interval (e.g. ``"1d"``).
+
+    Returns:
+        Mapping ticker -> DataFrame (empty when Yahoo had no data).
+    """
+    out: Dict[str, pd.DataFrame] = {}
+    misses: Dict[str, Tuple[str, str]] = {}  # yahoo symbol -> (ticker, cache key)
+    for t in tickers:
+        key = fetch_history_yahoo.cache_key(t, market=market, period=period, interval=interval)
+        hit = cache.get(key) if cache.CACHE_ENABLED else None
+        if hit is None and cache.CACHE_ENABLED:
+            try:
+                hit = fetch_history_yahoo.incremental_entry(t, market=market, period=period, interval=interval)
+            except Exception:
+                hit = None
+        if hit is not None:
+            out[t] = hit
+        else:
+            misses[_normalize_yahoo_symbol(t, market)] = (t, key)
+    if not misses:
+        return out
+
+    import yfinance as yf  # type: ignore  # Local import to avoid hard dependency when unused
+
+    try:
+        raw = _with_retry(
+            yf.download,
+            list(misses),
+            period=period,
+            interval=interval,
+            auto_adjust=False,
+            progress=False,
+            group_by="ticker",
+            threads=True,
+            timeout=YAHOO_TIMEOUT,
+        )
+    except Exception as exc:
+        print(f"[WARN] yahoo batch download failed ({exc!r}); fetching {len(misses)} symbols one by one")
+        for t, _key in misses.values():
+            try:
+                out[t] = fetch_history_yahoo(t, market=market, period=period, interval=interval)
+            except Exception as exc_t:
+                print(f"[WARN] yahoo failed for {t}: {exc_t!r}")
+                out[t] = pd.DataFrame()
+        return out
+    batch_ok = raw is not None and not raw.empty
+    multi = raw is not None and isinstance(raw.columns, pd.MultiIndex)
+    level0 = set(raw.columns.get_level_values(0)) if multi else set()
+
+    for sym, (t, key) in misses.items():
+        if not batch_ok:
+            part = None
+        elif multi:
+            part = raw[sym] if sym in level0 else None
+        else:
+            # older yfinance returns flat columns for a single symbol
+            part = raw if len(misses) == 1 else None
+        # the batch frame is aligned on the union of dates: drop other tickers' rows
+        df = _normalize_ohlcv(part.dropna(how="all")) if part is not None else pd.DataFrame()
+        if df.empty and batch_ok and len(misses) > 1:
+            # yfinance reports a symbol that failed inside a batch as missing or
+            # all-NaN columns: retry it alone (cached single path, incl. stale)
+            out[t] = fetch_history_yahoo(t, market=market, period=period, interval=interval)
+            continue
+        if cache.CACHE_ENABLED and not df.empty:
+            cache.put(key, df)
+        elif cache.CACHE_ENABLED and cache.STALE_DAYS > 0:
+            stale = fetch_history_yahoo.stale_entry(t, market=market, period=period, interval=interval)
+            if stale is not None:
+                df = stale
+        out[t] = df
+    return out
 
 
 def fetch_history_brapi(ticker: str, period: str = "10y", interval: str = "1d") -> pd.DataFrame:
@@ -114,6 +324,7 @@ def fetch_history_brapi(ticker: str, period: str = "10y", interval: str = "1d")
     return df
 
 
+@cached("fx")
 def fetch_history_fx(ticker: str, period_days: int = 3650) -> pd.DataFrame:
     """Fetch FX time series from exchangerate.host.
 
@@ -129,8 +340,6 @@ def fetch_history_fx(ticker: str, period_days: int = 3650) -> pd.DataFrame:
     Returns:
         DataFrame with columns ``Datetime``, ``Open``, ``High``, ``Low``, ``Close``, ``Volume``.
     """
-    import requests
-
     t = (ticker or "").upper().replace("-", "").replace("_", "")
     if "/" in t:
         base, quote = t.split("/")
@@ -141,9 +350,9 @@ def fetch_history_fx(ticker: str, period_days: int = 3650) -> pd.DataFrame:
     start = end - dt.timedelta(days=period_days)
     url = f"https://api.frankfurter.app/{start.isoformat()}..{end.isoformat()}?from={base}&to={quote}"
     try:
-        r = requests.get(url, timeout=20)
+        r = _with_retry(_FX_SESSION.get, url, timeout=20)
         r.raise_for_status()
-        payload = r.json()
+        payload = orjson.loads(r.content) if orjson is not None else r.json()
     except Exception:
         return pd.DataFrame()
 
@@ -151,20 +360,36 @@ def fetch_history_fx(ticker: str, period_days: int = 3650) -> pd.DataFrame:
     if not rates:
         return pd.DataFrame()
 
-    rows = []
+    n = len(rates)
+    dates = np.empty(n, dtype="datetime64[D]")
+    closes = np.empty(n, dtype=np.float64)
+    i = 0
     for date_str, obj in rates.items():
         px = obj.get(quote)
         if px is None:
             continue
-        rows.append({"Datetime": pd.to_datetime(date_str), "Close": float(px)})
+        # Frankfurter returns ISO dates, which numpy parses directly
+        dates[i] = date_str
+        closes[i] = px
+        i += 1
 
-    if not rows:
+    if i == 0:
         return pd.DataFrame()
-
-    df = pd.DataFrame(rows).sort_values("Datetime").reset_index(drop=True)
-    # Duplicate Close into OHLC fields and zero volume
-    df["Open"] = df["Close"]
-    df["High"] = df["Close"]
-    df["Low"] = df["Close"]
-    df["Volume"] = 0.0
-    return df[["Datetime", "Open", "High", "Low", "Close", "Volume"]]
\ No newline at end of file
+    dates, closes = dates[:i], closes[:i]
+
+    # rates usually arrive in date order: sort only when they don't
+    if i > 1 and not (dates[1:] >= dates[:-1]).all():
+        order = np.argsort(dates, kind="stable")
+        dates, closes = dates[order], closes[order]
+
+    # Close duplicated into the OHLC fields, zero volume; one construction
+    return pd.DataFrame(
+        {
+            "Datetime": dates.astype("datetime64[ns]"),
+            "Open": closes,
+            "High": closes,
+            "Low": closes,
+            "Close": closes,
+            "Volume": np.zeros(i),
+        }
+    )
\ No newline at end of file
@@ -2,16 +2,134 @@
 Routing logic for selecting the appropriate history provider.
 
 This module defines ``route_fetch_history`` which inspects asset metadata and
-chooses the best provider function for fetching historical price data. It
-relies on provider implementations in ``core.providers``. Additional routing
-rules can be added here as the system evolves.
+chooses the best provider function for fetching historical price data, and
+``route_fetch_history_many`` which does the same for a whole universe while
+batching requests per provider. It relies on provider implementations in
+``core.providers``. Additional routing rules can be added here as the system
+evolves.
+
+Providers are registered by name in ``PROVIDERS``. The rule-based provider is
+always tried first; ``FABRICA_PROVIDERS`` (comma-separated, e.g.
+``"yahoo,brapi"``) lists fallbacks tried in order when it returns no data.
+Fallbacks only apply to B3 equity providers; FX pairs have a single source.
+
+Concurrent requests per provider are capped by ``PROVIDER_CONCURRENCY``
+(politeness limits: Yahoo throttles aggressively, the APIs less so).
+``FABRICA_FETCH_TIMEOUT`` (seconds, default off) bounds how long a batch run
+waits for the provider groups; groups still pending are left empty. Groups
+run on daemon threads, so an abandoned one doesn't hold interpreter exit;
+requests already in flight inside it end on their own per-request timeouts
+(Yahoo/FX 20s, BRAPI 30s, times the retry attempts).
 """
 from __future__ import annotations
 
-from typing import Optional
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 import pandas as pd
 
-from core.providers import fetch_history_yahoo, fetch_history_brapi, fetch_history_fx
+from core.data import fetch_history_many as fetch_history_brapi_many
+from core.providers import (
+    downcast_ohlcv,
+    fetch_history_brapi,
+    fetch_history_fx,
+    fetch_history_yahoo,
+    fetch_history_yahoo_many,
+)
+
+STOCK_TYPES = {"STOCK", "ACAO", "AÇÃO", "EQUITY"}
+EQUITY_PROVIDERS = ("yahoo", "brapi")
+FALLBACK_PROVIDERS = [
+    p.strip().lower() for p in os.getenv("FABRICA_PROVIDERS", "").split(",") if p.strip()
+]
+# max in-flight requests per provider host
+PROVIDER_CONCURRENCY = {"yahoo": 2, "brapi": 8, "fx": 8}
+_SLOTS = {name: threading.BoundedSemaphore(n) for name, n in PROVIDER_CONCURRENCY.items()}
+FETCH_TIMEOUT: Optional[float] = float(os.getenv("FABRICA_FETCH_TIMEOUT", "0")) or None
+
+
+@functools.lru_cache(maxsize=4096)
+def _norm(s: Optional[str]) -> str:
+    """Upper-cased, stripped code (``""`` for ``None``)."""
+    return s.strip().upper() if s else ""
+
+
+@functools.lru_cache(maxsize=4096)
+def _provider_for(asset_type: str, market: str) -> str:
+    """Name the provider (``"yahoo"``, ``"brapi"`` or ``"fx"``) for an asset."""
+    at = _norm(asset_type)
+    mk = _norm(market)
+
+    # ETFs traded on B3 → Yahoo Finance
+    if at == "ETF" and mk == "B3":
+        return "yahoo"
+
+    # Stocks traded on B3 → BRAPI (delegate to existing core.data)
+    if at in STOCK_TYPES and mk == "B3":
+        return "brapi"
+
+    # Foreign exchange → dedicated FX provider
+    if at == "FX":
+        return "fx"
+
+    # Fallback: delegate to BRAPI for unknown asset types
+    return "brapi"
+
+
+@functools.lru_cache(maxsize=64)
+def _period_to_days(period: str) -> int:
+    """Convert a period string like ``"10y"`` to days for the FX provider."""
+    # interval and period don't map directly; convert period to days
+    if period.lower() in {"max", "10y"}:
+        return 3650
+    if period.lower().endswith("y"):
+        try:
+            return int(period[:-1]) * 365
+        except ValueError:
+            return 3650
+    # Default to 10 years
+    return 3650
+
+
+# name -> fetch(ticker, market, period, interval)
+PROVIDERS: Dict[str, Callable[[str, str, str, str], pd.DataFrame]] = {
+    "yahoo": lambda t, mk, period, interval: fetch_history_yahoo(t, market=mk, period=period, interval=interval),
+    "brapi": lambda t, mk, period, interval: fetch_history_brapi(t, period=period, interval=interval),
+    "fx": lambda t, mk, period, interval: fetch_history_fx(t, period_days=_period_to_days(period)),
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _provider_chain(asset_type: str, market: str) -> Tuple[str, ...]:
+    """Ordered provider names to try for an asset (rule-based one first)."""
+    primary = _provider_for(asset_type, market)
+    if primary not in EQUITY_PROVIDERS:
+        return (primary,)
+    return (primary, *(p for p in FALLBACK_PROVIDERS if p != primary and p in EQUITY_PROVIDERS))
+
+
+def _fetch_chain(
+    ticker: str, chain: Iterable[str], market: str, period: str, interval: str
+) -> pd.DataFrame:
+    """Try each provider in ``chain`` until one returns data.
+
+    A provider that raises is treated like one that returned nothing, so a
+    single bad ticker never aborts a basket run.
+    """
+    for name in chain:
+        try:
+            with _SLOTS[name]:
+                df = PROVIDERS[name](ticker, market, period, interval)
+        except Exception as exc:
+            print(f"[WARN] {name} failed for {ticker}: {exc!r}")
+            continue
+        if df is not None and not df.empty:
+            return downcast_ohlcv(df)
+    return pd.DataFrame()
 
 
 def route_fetch_history(
@@ -34,32 +152,101 @@ def route_fetch_history(
     Returns:
         DataFrame with OHLC data. May be empty if no provider yields data.
     """
-    at = (asset_type or "").strip().upper()
-    mk = (market or "").strip().upper()
+    mk = _norm(market)
+    return _fetch_chain(ticker, _provider_chain(asset_type, market), mk, period, interval)
 
-    # ETFs traded on B3 → Yahoo Finance
-    if at == "ETF" and mk == "B3":
-        return fetch_history_yahoo(ticker, market=mk, period=period, interval=interval)
 
-    # Stocks traded on B3 → BRAPI (delegate to existing core.data)
-    if at in {"STOCK", "ACAO", "AÇÃO", "EQUITY"} and mk == "B3":
-        return fetch_history_brapi(ticker, period=period, interval=interval)
+def _fetch_group(
+    provider: str, mk: str, tickers: List[str], period: str, interval: str, max_workers: int
+) -> Dict[str, pd.DataFrame]:
+    """Fetch one ``(provider, market)`` group with its batch/pool strategy."""
+    workers = min(max_workers, PROVIDER_CONCURRENCY[provider], len(tickers))
+    if provider == "yahoo":
+        with _SLOTS["yahoo"]:
+            return fetch_history_yahoo_many(tickers, market=mk, period=period, interval=interval)
+    if provider == "fx":
+        # per-pair chain: each pair gets its own slot and error isolation
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return dict(zip(tickers, ex.map(lambda t: _fetch_chain(t, ("fx",), mk, period, interval), tickers)))
+    # cache hits inside the BRAPI pool return without touching the network
+    return fetch_history_brapi_many(tickers, period=period, interval=interval, max_workers=workers)
 
-    # Foreign exchange → dedicated FX provider
-    if at == "FX":
-        # interval and period don't map directly; convert period to days
-        if period.lower() in {"max", "10y"}:
-            days = 3650
-        elif period.lower().endswith("y"):
-            try:
-                years = int(period[:-1])
-                days = years * 365
-            except ValueError:
-                days = 3650
-        else:
-            # Default to 10 years
-            days = 3650
-        return fetch_history_fx(ticker, period_days=days)
 
-    # Fallback: delegate to BRAPI for unknown asset types
-    return fetch_history_brapi(ticker, period=period, interval=interval)
\ No newline at end of file
+def _run_group(slot: Dict[str, object], *args) -> None:
+    """Thread target: ``_fetch_group(*args)`` into ``slot`` (``result`` or ``error``)."""
+    try:
+        slot["result"] = _fetch_group(*args)
+    except Exception as exc:
+        slot["error"] = exc
+
+
+def route_fetch_history_many(
+    assets: Iterable[Tuple[str, str, str]],
+    *,
+    period: str = "10y",
+    interval: str = "1d",
+    max_workers: int = 8,
+    timeout: Optional[float] = FETCH_TIMEOUT,
+) -> Dict[str, pd.DataFrame]:
+    """Fetch histories for many assets, batching per provider.
+
+    Assets are grouped by ``(provider, market)`` and the groups run
+    concurrently: Yahoo groups go out as a single multi-ticker download
+    (cached symbols skip it), BRAPI groups use the BRAPI thread pool and FX
+    pairs are fetched in parallel, each capped by ``PROVIDER_CONCURRENCY``.
+    Tickers left empty then go through their fallback providers, also in
+    parallel. Provider errors are logged and leave the ticker empty; so do
+    groups still running after ``timeout`` seconds (their daemon threads are
+    abandoned, not killed; see the module docstring for what bounds them).
+
+    Args:
+        assets: ``(ticker, asset_type, market)`` tuples.
+        period: Duration of historical data requested (default 10 years).
+        interval: Sampling interval (default daily).
+        max_workers: Thread cap per group (and for fallbacks).
+        timeout: Seconds to wait for the provider groups (``None``: no limit).
+
+    Returns:
+        Mapping ticker -> DataFrame (empty when no data was returned).
+    """
+    groups: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    fallbacks: Dict[str, Tuple[Tuple[str, ...], str]] = {}
+    for ticker, asset_type, market in assets:
+        mk = _norm(market)
+        chain = _provider_chain(asset_type, market)
+        groups[(chain[0], mk)].append(ticker)
+        if len(chain) > 1:
+            fallbacks[ticker] = (chain[1:], mk)
+
+    out: Dict[str, pd.DataFrame] = {}
+    if groups:
+        # provider groups hit different hosts: run them side by side, on
+        # daemon threads so a group abandoned at the timeout can't block exit
+        running = []
+        for (provider, mk), tickers in groups.items():
+            slot: Dict[str, object] = {}
+            th = threading.Thread(
+                target=_run_group,
+                args=(slot, provider, mk, tickers, period, interval, max_workers),
+                name=f"fetch-{provider}-{mk}",
+                daemon=True,
+            )
+            th.start()
+            running.append((th, provider, slot))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for th, provider, slot in running:
+            th.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if th.is_alive():
+                print(f"[WARN] {provider} batch timed out after {timeout}s")
+            elif "error" in slot:
+                # the group's tickers stay missing: fallbacks or skip
+                print(f"[WARN] {provider} batch failed: {slot['error']!r}")
+            else:
+                out.update(slot["result"])
+
+    retry = [t for t in fallbacks if out.get(t) is None or out[t].empty]
+    if retry:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(retry))) as ex:
+            frames = ex.map(lambda t: _fetch_chain(t, fallbacks[t][0], fallbacks[t][1], period, interval), retry)
+            out.update(zip(retry, frames))
+    return {t: downcast_ohlcv(df) for t, df in out.items()}
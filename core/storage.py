@@ -1,10 +1,41 @@
+import atexit
+import contextlib
 import json
+import mmap
 import os
-from datetime import datetime
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_UTC = timezone.utc
 
 STATE_DIR = "state"
 STATE_FILE = os.path.join(STATE_DIR, "state.json")
+# STATE_FMT=parquet: positions/last_prices em colunas (ticker, state, weight, last_price)
+POSITIONS_FILE = os.path.join(STATE_DIR, "positions.parquet")
+_POSITIONS_TAG = b"fabrica_state_tag"
 LOG_FILE = os.path.join(STATE_DIR, "events.log")
+# índice lateral do log: offset (uint64) do início de cada linha
+INDEX_FILE = LOG_FILE + ".idx"
+
+# formato do state.json: "json" (indentado, legível no diff do git),
+# "compact" (orjson sem indentação; menor e mais rápido) ou "parquet"
+# (compact + tabelas por ticker em POSITIONS_FILE; precisa de pyarrow)
+STATE_FMT = os.getenv("STATE_FMT", "json").strip().lower()
+
+# chaves derivadas do histórico (refeitas se faltarem): fora dos snapshots
+# diários versionados no git
+_SNAPSHOT_SKIP = ("sma_cache",)
+
+# buffer do audit trail: descarrega a cada N eventos ou após um intervalo curto
+LOG_BATCH_SIZE = 16
+LOG_FLUSH_INTERVAL = 0.05  # segundos
 
 
 DEFAULT_STATE = {
@@ -18,6 +49,11 @@ DEFAULT_STATE = {
 }
 
 
+def _default_state() -> dict:
+    """Cópia de DEFAULT_STATE com dicts próprios (quem muta positions não polui o default)."""
+    return {k: (v.copy() if isinstance(v, dict) else v) for k, v in DEFAULT_STATE.items()}
+
+
 def _ensure_state_dir():
     os.makedirs(STATE_DIR, exist_ok=True)
     # garante que o git mantém a pasta
@@ -29,75 +65,217 @@ def _ensure_state_dir():
             pass
 
 
+def _read_state_file(path: str):
+    with open(path, "rb") as f:
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _write_positions_table(state: dict, tag: str) -> bool:
+    """
+    Grava positions/last_prices como colunas (struct-of-arrays) em parquet:
+    tmp + fsync, backup do anterior em .bak e replace atômico (como o json).
+    tag (o last_run do save) vai no metadata do parquet e no marcador do json,
+    para a leitura detectar tabela e json de saves diferentes.
+    Retorna False se pyarrow não estiver disponível (fica tudo no json).
+    """
+    try:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.parquet as pq  # type: ignore
+    except ImportError:
+        return False
+
+    positions = state.get("positions") or {}
+    prices = state.get("last_prices") or {}
+    tickers = list(dict.fromkeys([*positions, *prices]))
+    nan = float("nan")
+    table = pa.table(
+        {
+            "ticker": pa.array(tickers, type=pa.string()),
+            "held": pa.array([t in positions for t in tickers], type=pa.bool_()),
+            "state": pa.array([int(positions.get(t, {}).get("state", 0)) for t in tickers], type=pa.int8()),
+            "weight": pa.array([float(positions.get(t, {}).get("weight", 0.0)) for t in tickers], type=pa.float64()),
+            "last_price": pa.array([float(prices.get(t, nan)) for t in tickers], type=pa.float64()),
+        },
+        metadata={_POSITIONS_TAG: tag.encode("utf-8")},
+    )
+    tmp = POSITIONS_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        pq.write_table(table, f)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(POSITIONS_FILE):
+        try:
+            os.replace(POSITIONS_FILE, POSITIONS_FILE + ".bak")
+        except Exception:
+            pass
+    os.replace(tmp, POSITIONS_FILE)
+    return True
+
+
+def _read_positions_table(path: str, tag: str):
+    """(positions, last_prices) de um parquet de posições, ou None se ilegível/de outro save."""
+    try:
+        import pyarrow.parquet as pq  # type: ignore
+
+        table = pq.read_table(path)
+        meta = table.schema.metadata or {}
+        if meta.get(_POSITIONS_TAG, b"").decode("utf-8") != tag:
+            return None
+        cols = table.to_pydict()
+    except Exception:
+        return None
+    rows = zip(cols["ticker"], cols["held"], cols["state"], cols["weight"], cols["last_price"])
+    positions, prices = {}, {}
+    for t, held, st, w, px in rows:
+        if held:
+            positions[t] = {"state": st, "weight": w}
+        if px == px:  # NaN = sem preço
+            prices[t] = px
+    return positions, prices
+
+
+def _restore_tables(merged: dict) -> dict:
+    """
+    STATE_FMT=parquet: repõe positions/last_prices no state lido do json.
+    Ordem: POSITIONS_FILE, o .bak dele, o snapshot completo do dia do
+    last_run. Só aceita fonte do mesmo save (tag); sem nenhuma, avisa e
+    segue com as tabelas vazias em vez de inventar posições.
+    """
+    tag = merged.pop("positions_file", None)
+    if tag is None:
+        return merged
+    tag = str(tag)
+    for path in (POSITIONS_FILE, POSITIONS_FILE + ".bak"):
+        tables = _read_positions_table(path, tag)
+        if tables is not None:
+            merged["positions"], merged["last_prices"] = tables
+            return merged
+    try:
+        snap = _read_state_file(os.path.join(STATE_DIR, "snapshots", f"{tag[:10]}.json"))
+        if isinstance(snap, dict) and snap.get("last_run") == merged.get("last_run"):
+            merged["positions"] = snap.get("positions") or {}
+            merged["last_prices"] = snap.get("last_prices") or {}
+            return merged
+    except Exception:
+        pass
+    print(f"[WARN] {POSITIONS_FILE} ausente/inconsistente e sem snapshot do mesmo run: positions vazias.")
+    return merged
+
+
 def load_state():
     """
     Leitura resiliente:
     - Se state.json não existir => DEFAULT_STATE
     - Se estiver corrompido/truncado => tenta backup; senão DEFAULT_STATE
+    - Com STATE_FMT=parquet, positions/last_prices vêm de POSITIONS_FILE
+      (ou do .bak dele / snapshot do dia, ver _restore_tables)
     """
     _ensure_state_dir()
 
     if not os.path.exists(STATE_FILE):
-        return DEFAULT_STATE.copy()
+        return _default_state()
 
     try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _read_state_file(STATE_FILE)
         # merge defensivo: garante chaves mínimas
-        merged = DEFAULT_STATE.copy()
+        merged = _default_state()
         if isinstance(data, dict):
             merged.update(data)
-        return merged
+        return _restore_tables(merged)
     except Exception:
         # fallback: tenta backup
         backup = STATE_FILE + ".bak"
         if os.path.exists(backup):
             try:
-                with open(backup, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                merged = DEFAULT_STATE.copy()
+                data = _read_state_file(backup)
+                merged = _default_state()
                 if isinstance(data, dict):
                     merged.update(data)
-                return merged
+                return _restore_tables(merged)
             except Exception:
                 pass
 
         # último recurso: volta pro default
-        return DEFAULT_STATE.copy()
+        return _default_state()
+
+
+def _dumps_state(payload: dict, human: bool = False) -> bytes:
+    indent = human or STATE_FMT not in ("compact", "parquet")
+    if orjson is not None:
+        opt = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            opt |= orjson.OPT_INDENT_2
+        return orjson.dumps(payload, option=opt)
+    if indent:
+        return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dump_state_human(state: dict = None) -> str:
+    """
+    state.json indentado para depuração (útil com STATE_FMT=compact).
+    Sem argumento, lê o state atual do disco.
+    """
+    if state is None:
+        state = load_state()
+    return _dumps_state(state, human=True).decode("utf-8")
 
 
 def save_state(state: dict):
     """
     Escrita atômica:
+    - serializa uma vez (orjson, se disponível)
     - escreve em tmp
     - faz backup do atual
     - replace atomic (os.replace)
     Isso evita state.json truncado.
+    Eventos pendentes do log são descarregados antes, para o state nunca
+    ficar à frente do audit trail.
     """
     _ensure_state_dir()
+    flush_events()
 
     tmp = STATE_FILE + ".tmp"
     bak = STATE_FILE + ".bak"
 
-    payload = DEFAULT_STATE.copy()
+    payload = _default_state()
     if isinstance(state, dict):
         payload.update(state)
+    raw = _dumps_state(payload)
+    snap_raw = (
+        _dumps_state({k: v for k, v in payload.items() if k not in _SNAPSHOT_SKIP})
+        if any(k in payload for k in _SNAPSHOT_SKIP)
+        else raw
+    )
+    tag = str(payload.get("last_run") or datetime.now(_UTC).isoformat())
+    if STATE_FMT == "parquet" and _write_positions_table(payload, tag):
+        # json fica só com escalares + marcador; tabelas no parquet
+        # (o snapshot diário continua com positions/last_prices)
+        slim = {k: v for k, v in payload.items() if k not in ("positions", "last_prices")}
+        slim["positions_file"] = tag
+        raw = _dumps_state(slim)
 
     # escreve tmp
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    with open(tmp, "wb") as f:
+        f.write(raw)
         f.flush()
         os.fsync(f.fileno())
 
-        # snapshot por data (governança)
+    # snapshot por data (governança)
     try:
-        import datetime as _dt
         snap_dir = os.path.join(STATE_DIR, "snapshots")
         os.makedirs(snap_dir, exist_ok=True)
-        day = _dt.datetime.utcnow().strftime("%Y-%m-%d")
+        # dia do last_run (o mesmo "now" do job); relógio só sem last_run
+        try:
+            day = datetime.strptime(str(payload.get("last_run"))[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            day = datetime.now(_UTC).strftime("%Y-%m-%d")
         snap_file = os.path.join(snap_dir, f"{day}.json")
-        with open(snap_file, "w", encoding="utf-8") as sf:
-            json.dump(payload, sf, ensure_ascii=False, indent=2)
+        with open(snap_file, "wb") as sf:
+            sf.write(snap_raw)
     except Exception:
         pass
 
@@ -110,14 +288,255 @@ def save_state(state: dict):
 
     # promote tmp -> final (atômico)
     os.replace(tmp, STATE_FILE)
+    _fsync_dir(STATE_DIR)
 
 
-def log_event(event: dict):
-    _ensure_state_dir()
+def _fsync_dir(path: str):
+    """fsync do diretório: torna o rename durável (POSIX; no-op onde não dá)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_LOG_FH = None
+_IDX_FH = None
+_LOG_BUF = []
+_LOG_LOCK = threading.Lock()
+_last_flush = time.monotonic()
+_BATCH_DEPTH = 0  # >0 dentro de log_batch(): sem flush automático
+
 
-    record = {"ts": datetime.utcnow().isoformat() + "Z"}
+def _dumps_line(record: dict) -> bytes:
+    if orjson is not None:
+        # newline emitido pelo próprio orjson (sem concatenar bytes); aceita
+        # escalares/arrays numpy vindos da estratégia
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _json_loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _read_index(path: str):
+    """Offsets do índice (array 'Q', byte order nativo) ou None se ausente/inválido."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    offsets = array("Q")
+    if len(raw) % offsets.itemsize:
+        return None
+    offsets.frombytes(raw)
+    return offsets
+
+
+def _index_matches(offsets, mm) -> bool:
+    """
+    O índice vale se a última linha indexada começa logo após um '\\n'
+    e termina exatamente no EOF (nada foi escrito no log sem passar por aqui).
+    """
+    size = len(mm)
+    if not offsets:
+        return False
+    last = offsets[-1]
+    if last >= size:
+        return False
+    if last > 0 and mm[last - 1] != 0x0A:
+        return False
+    return mm.find(b"\n", last) == size - 1
+
+
+def _scan_line_starts(mm, limit=None):
+    """Offsets de início de linha varrendo o log de trás pra frente (rfind em C)."""
+    end = len(mm)
+    if end and mm[end - 1] == 0x0A:
+        end -= 1
+    starts = []
+    while end > 0 and (limit is None or len(starts) < limit):
+        i = mm.rfind(b"\n", 0, end)
+        starts.append(i + 1)
+        end = i
+    starts.reverse()
+    return starts
+
+
+def _sync_index():
+    """Garante que events.log.idx cobre o log inteiro; reconstrói se não cobrir."""
+    offsets = _read_index(INDEX_FILE)
+    try:
+        with open(LOG_FILE, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                starts = []
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if offsets is not None and _index_matches(offsets, mm):
+                        return
+                    starts = _scan_line_starts(mm)
+    except OSError:
+        starts = []
+
+    tmp = INDEX_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        array("Q", starts).tofile(f)
+    os.replace(tmp, INDEX_FILE)
+
+
+def _flush_locked():
+    """Descarrega o buffer no handle persistente (+ índice). Chamar com _LOG_LOCK."""
+    global _LOG_FH, _IDX_FH, _last_flush
+    _last_flush = time.monotonic()
+    if not _LOG_BUF:
+        return
+    if _LOG_FH is None:
+        _ensure_state_dir()
+        _sync_index()
+        _LOG_FH = open(LOG_FILE, "ab")
+        _IDX_FH = open(INDEX_FILE, "ab")
+
+    pos = _LOG_FH.seek(0, os.SEEK_END)
+    offsets = array("Q")
+    for line in _LOG_BUF:
+        offsets.append(pos)
+        pos += len(line)
+
+    # log antes do índice: leitor que pegar o meio do caminho cai no fallback
+    _LOG_FH.writelines(_LOG_BUF)
+    _LOG_FH.flush()
+    offsets.tofile(_IDX_FH)
+    _IDX_FH.flush()
+    _LOG_BUF.clear()
+
+
+def set_state_dir(path: str):
+    """
+    Aponta state/log/posições para outro diretório (ex.: um por config).
+    Descarrega e fecha o log atual antes; o novo abre sob demanda.
+    """
+    global STATE_DIR, STATE_FILE, POSITIONS_FILE, LOG_FILE, INDEX_FILE
+    _flush_and_close()
+    STATE_DIR = path
+    STATE_FILE = os.path.join(STATE_DIR, "state.json")
+    POSITIONS_FILE = os.path.join(STATE_DIR, "positions.parquet")
+    LOG_FILE = os.path.join(STATE_DIR, "events.log")
+    INDEX_FILE = LOG_FILE + ".idx"
+
+
+def flush_events(sync: bool = False):
+    """
+    Força a escrita dos eventos pendentes (útil em testes e antes de sair).
+    sync=True também faz fsync do log (durável em disco).
+    """
+    with _LOG_LOCK:
+        _flush_locked()
+        if sync and _LOG_FH is not None:
+            os.fsync(_LOG_FH.fileno())
+
+
+@contextlib.contextmanager
+def log_batch():
+    """
+    Agrupa eventos: dentro do bloco log_event só acumula no buffer; na saída
+    vai tudo num único write + fsync. Uso:
+        with log_batch() as log:
+            log({"type": "X"})
+    """
+    global _BATCH_DEPTH
+    with _LOG_LOCK:
+        _BATCH_DEPTH += 1
+    try:
+        yield log_event
+    finally:
+        with _LOG_LOCK:
+            _BATCH_DEPTH -= 1
+        if _BATCH_DEPTH == 0:
+            flush_events(sync=True)
+
+
+def _flush_and_close():
+    global _LOG_FH, _IDX_FH
+    with _LOG_LOCK:
+        try:
+            _flush_locked()
+        finally:
+            for fh in (_LOG_FH, _IDX_FH):
+                if fh is not None:
+                    fh.close()
+            _LOG_FH = _IDX_FH = None
+
+
+atexit.register(_flush_and_close)
+
+
+def log_event(event: dict):
+    """
+    Append no audit trail (JSONL) sem abrir/fechar o arquivo a cada evento:
+    - serializa pro buffer em memória
+    - descarrega a cada LOG_BATCH_SIZE eventos ou LOG_FLUSH_INTERVAL segundos
+    - atexit garante o flush no fim do processo
+    """
+    if isinstance(event, dict) and "ts" in event:
+        # caller já carimbou (run_daily): não formata um timestamp que seria sobrescrito
+        record = {"ts": event["ts"]}
+    else:
+        # mesmo formato de antes (naive + "Z"), sem o utcnow() deprecado
+        record = {"ts": datetime.now(_UTC).replace(tzinfo=None).isoformat() + "Z"}
     if isinstance(event, dict):
         record.update(event)
 
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    line = _dumps_line(record)
+    with _LOG_LOCK:
+        _LOG_BUF.append(line)
+        if _BATCH_DEPTH:
+            return
+        if len(_LOG_BUF) >= LOG_BATCH_SIZE or time.monotonic() - _last_flush > LOG_FLUSH_INTERVAL:
+            _flush_locked()
+
+
+def load_events_tail(n: int, log_file: str = None):
+    """
+    Últimos n eventos do log sem parsear o arquivo inteiro:
+    mmap do log + offsets do índice lateral (ou rfind reverso, se o índice
+    estiver ausente/desatualizado). Linhas quebradas são ignoradas.
+    log_file padrão: o LOG_FILE atual (segue set_state_dir).
+    """
+    if n <= 0:
+        return []
+    if log_file is None:
+        log_file = LOG_FILE
+    try:
+        f = open(log_file, "rb")
+    except OSError:
+        return []
+
+    rows = []
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return rows
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offsets = _read_index(log_file + ".idx")
+            if offsets is not None and _index_matches(offsets, mm):
+                starts = offsets[-n:].tolist()
+            else:
+                starts = _scan_line_starts(mm, limit=n)
+
+            ends = starts[1:] + [len(mm)]
+            for a, b in zip(starts, ends):
+                line = mm[a:b].rstrip()
+                if not line:
+                    continue
+                try:
+                    rows.append(_json_loads(line))
+                except ValueError:
+                    pass
+    return rows
@@ -0,0 +1,99 @@
+"""
+Escritas de storage fora do caminho crítico.
+
+save_state (json + fsync) e log_event rodam numa thread de fundo, em ordem
+FIFO (o evento RUN continua gravado antes do state). O chamador recebe o
+controle de volta na hora; no fim do processo o atexit drena a fila antes
+do flush final do log (registrado depois do core.storage => roda antes).
+Cada rajada de itens na fila roda dentro de log_batch(): um write + fsync
+do log por rajada, não por evento.
+
+Uma escrita que falha não derruba o worker: a primeira exceção (inclusive a
+do flush na saída do log_batch) fica guardada e drain() a relança. Erro em
+callback do atexit só é impresso, então quem precisa de exit != 0 chama
+drain() explicitamente (ver jobs/run_daily.py).
+"""
+import atexit
+import copy
+import queue
+import threading
+
+from core.storage import log_batch, log_event, save_state
+
+_QUEUE = queue.SimpleQueue()
+_STOP = object()
+_WORKER = None
+_LOCK = threading.Lock()
+# primeira falha de escrita desde o último drain()
+_ERROR = None
+
+
+def _record(exc: BaseException):
+    global _ERROR
+    if _ERROR is None:
+        _ERROR = exc
+
+
+def _worker():
+    while True:
+        item = _QUEUE.get()
+        try:
+            with log_batch():
+                while item is not _STOP:
+                    fn, arg = item
+                    try:
+                        fn(arg)
+                    except Exception as exc:
+                        print(f"[WARN] escrita em background falhou ({fn.__name__}): {exc!r}")
+                        _record(exc)
+                    try:
+                        item = _QUEUE.get_nowait()
+                    except queue.Empty:
+                        break
+        except Exception as exc:
+            # flush do log na saída do log_batch: o worker segue vivo
+            print(f"[WARN] flush do log em background falhou: {exc!r}")
+            _record(exc)
+        if item is _STOP:
+            return
+
+
+def _enqueue(fn, arg):
+    global _WORKER
+    with _LOCK:
+        if _WORKER is None:
+            _WORKER = threading.Thread(target=_worker, name="storage-writer", daemon=True)
+            _WORKER.start()
+    # cópia profunda: o chamador pode seguir mutando o dict
+    _QUEUE.put((fn, copy.deepcopy(arg)))
+
+
+def save_state_async(state: dict):
+    """Agenda save_state(state) na thread de fundo."""
+    _enqueue(save_state, state)
+
+
+def log_event_async(event: dict):
+    """Agenda log_event(event) na thread de fundo."""
+    _enqueue(log_event, event)
+
+
+def drain():
+    """
+    Espera todas as escritas pendentes terminarem (idempotente) e relança a
+    primeira falha de escrita desde o último drain().
+    """
+    global _WORKER, _ERROR
+    # segura o lock até o join: um _enqueue concorrente não cria outro
+    # worker que consumiria o _STOP deste
+    with _LOCK:
+        if _WORKER is not None:
+            _QUEUE.put(_STOP)
+            _WORKER.join()
+            _WORKER = None
+        err, _ERROR = _ERROR, None
+    if err is not None:
+        raise err
+
+
+atexit.register(drain)
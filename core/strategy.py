@@ -1,8 +1,24 @@
 # core/strategy.py
 from __future__ import annotations
 
+from typing import Dict, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 
+__all__ = ["signal_on_off", "last_signal", "signal_on_off_incremental", "signal_on_off_njit"]
+
+try:
+    import bottleneck as bn  # type: ignore
+except Exception:  # bottleneck é opcional (média móvel em C)
+    bn = None
+
+from core._compat import enable_copy_on_write
+from core._fastmath import last_sma_signal_jit, sma_jit
+
+# Copy-on-Write: fatias/set_axis viram views em vez de cópias defensivas
+enable_copy_on_write()
+
 
 def _ensure_datetime_index(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -13,35 +29,32 @@ def _ensure_datetime_index(df: pd.DataFrame) -> pd.DataFrame:
       3) Coluna 'Date'
       4) Converter índice
     """
-    out = df.copy()
-
     # 1) Já é DatetimeIndex
-    if isinstance(out.index, pd.DatetimeIndex):
-        out = out[~out.index.isna()]
-        return out.sort_index()
-
-    # 2) Coluna Datetime
-    if "Datetime" in out.columns:
-        dt = pd.to_datetime(out["Datetime"], errors="coerce")
-        mask = ~dt.isna()
-        out = out.loc[mask].copy()
-        out.index = dt.loc[mask]
-        out = out.drop(columns=["Datetime"], errors="ignore")
-        return out.sort_index()
-
-    # 3) Coluna Date
-    if "Date" in out.columns:
-        dt = pd.to_datetime(out["Date"], errors="coerce")
-        mask = ~dt.isna()
-        out = out.loc[mask].copy()
-        out.index = dt.loc[mask]
-        out = out.drop(columns=["Date"], errors="ignore")
-        return out.sort_index()
+    if isinstance(df.index, pd.DatetimeIndex):
+        out = df[~df.index.isna()] if df.index.hasnans else df
+        return _sorted(out)
+
+    # 2) Coluna Datetime / 3) Coluna Date
+    for col in ("Datetime", "Date"):
+        if col in df.columns:
+            dt = pd.to_datetime(df[col], errors="coerce")
+            mask = dt.notna().to_numpy()
+            out = df.drop(columns=[col])
+            if not mask.all():
+                out = out.loc[mask]
+                dt = dt.loc[mask]
+            return _sorted(out.set_axis(pd.DatetimeIndex(dt), axis=0))
 
     # 4) Último recurso: tentar converter índice
-    out.index = pd.to_datetime(out.index, errors="coerce")
-    out = out[~out.index.isna()]
-    return out.sort_index()
+    out = df.set_axis(pd.to_datetime(df.index, errors="coerce"), axis=0)
+    if out.index.hasnans:
+        out = out[~out.index.isna()]
+    return _sorted(out)
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    """Ordena pelo índice só se necessário (dados de provider já vêm ordenados)."""
+    return df if df.index.is_monotonic_increasing else df.sort_index()
 
 
 def _extract_close_series(df: pd.DataFrame) -> pd.Series:
@@ -62,10 +75,30 @@ def _extract_close_series(df: pd.DataFrame) -> pd.Series:
     if isinstance(close, pd.DataFrame):
         close = close.iloc[:, 0]
 
+    if close.dtype.kind == "f":
+        return close
     return pd.to_numeric(close, errors="coerce")
 
 
-def signal_on_off(df: pd.DataFrame, sma_window: int = 126) -> pd.DataFrame:
+def _move_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Média móvel simples com janela cheia (NaN nas w-1 primeiras posições).
+    Ordem: kernel numba (soma corrida O(N)), bottleneck.move_mean, np.convolve.
+    Janelas com NaN resultam em NaN, como no rolling().mean() do pandas.
+    """
+    if sma_jit is not None and window >= 1:
+        return sma_jit(values, window)
+    if bn is not None:
+        return bn.move_mean(values, window=window, min_count=window)
+
+    out = np.full(values.shape[0], np.nan, dtype=values.dtype)
+    if window <= values.shape[0]:
+        kernel = np.full(window, 1.0 / window, dtype=values.dtype)
+        out[window - 1:] = np.convolve(values, kernel, mode="valid")
+    return out
+
+
+def signal_on_off(df: pd.DataFrame, sma_window: int = 126, tail_only: bool = False) -> pd.DataFrame:
     """
     Trend filter On/Off via SMA.
 
@@ -73,6 +106,10 @@ def signal_on_off(df: pd.DataFrame, sma_window: int = 126) -> pd.DataFrame:
       - Close (Series)
       - SMA
       - Signal (0/1)
+
+    tail_only=True calcula só as últimas sma_window barras: a última linha
+    é a mesma da série completa (o resto do SMA fica NaN). Serve para quem
+    só consome iloc[-1] sem pagar a média móvel do histórico inteiro.
     """
     if df is None or len(df) == 0:
         return pd.DataFrame()
@@ -81,16 +118,115 @@ def signal_on_off(df: pd.DataFrame, sma_window: int = 126) -> pd.DataFrame:
     if out.empty:
         return pd.DataFrame()
 
+    w = int(sma_window)
+    if tail_only and w >= 1:
+        out = out.iloc[-w:]
+
     close = _extract_close_series(out)
 
-    w = int(sma_window)
-    sma = close.rolling(window=w, min_periods=w).mean()
+    # Conta em NumPy; pandas só na fronteira
+    # float32 (FABRICA_DTYPE_DOWNCAST) fica em float32 até o fim
+    close_arr = close.to_numpy(dtype=np.float32 if close.dtype == np.float32 else np.float64)
+    sma_arr = _move_mean(close_arr, w)
+    # NaN > x é False → 0 onde não há SMA; int64 como o astype(int) antigo
+    # (uint8 daria 255 em diff()/-1)
+    signal_arr = (close_arr > sma_arr).astype(np.int64)
+
+    return out.assign(Close=close_arr, SMA=sma_arr, Signal=signal_arr)
+
+
+def last_signal(df: pd.DataFrame, sma_window: int = 126) -> Optional[Tuple[int, float]]:
+    """
+    Caminho rápido do job diário: só o último (Signal, Close).
 
-    result = out.copy()
-    result["Close"] = close
-    result["SMA"] = sma
+    Mesmo resultado da última linha de signal_on_off, mas soma apenas as
+    últimas sma_window barras (kernel numba se disponível) em vez de
+    montar a série inteira de SMA. Retorna None se não houver dados.
+    """
+    if df is None or len(df) == 0:
+        return None
+
+    out = _ensure_datetime_index(df)
+    if out.empty:
+        return None
+
+    close_arr = _extract_close_series(out).to_numpy(dtype=np.float64)
+    return signal_on_off_njit(close_arr, sma_window)
+
+
+def signal_on_off_njit(closes: np.ndarray, window: int) -> Tuple[int, float]:
+    """
+    (Signal, Close) da última barra direto de um array float64 contíguo.
+
+    Kernel numba (compilado na importação de core._fastmath, com cache em
+    disco) quando disponível; senão NumPy. Sem fastmath: NaN na janela tem
+    que dar SMA NaN e sinal 0, como no rolling().mean(). Outros dtypes
+    (ex.: float32 do FABRICA_DTYPE_DOWNCAST) são convertidos para float64,
+    a única assinatura do kernel.
+    """
+    closes = np.ascontiguousarray(closes, dtype=np.float64)
+    w = int(window)
+    if last_sma_signal_jit is not None and w >= 1:
+        signal, last = last_sma_signal_jit(closes, w)
+        return int(signal), float(last)
+
+    last = closes[-1]
+    sma = closes[-w:].mean() if len(closes) >= w else np.nan
+    return (1 if last > sma else 0), float(last)
 
-    signal = (close > sma).astype("Int64").fillna(0).astype(int)
-    result["Signal"] = signal
 
-    return result
+def signal_on_off_incremental(
+    prev: Optional[Dict], df: pd.DataFrame, sma_window: int = 126
+) -> Optional[Tuple[int, float, Optional[Dict]]]:
+    """
+    Último (Signal, Close) com a janela da SMA persistida entre execuções.
+
+    prev é o cache da execução anterior: {"date": iso da última barra,
+    "window_tail": últimos sma_window closes}. A janela do cache é conferida
+    contra o histórico (O(w)) e desliza com as barras depois de prev["date"]:
+    sai o close mais antigo, entra o novo. Se o cache não bate com o
+    histórico (janela mudou, barra revisada em qualquer ponto da janela,
+    buraco, NaN), a janela é refeita a partir das últimas sma_window barras.
+    A SMA é a soma exata da janela (O(w), como a conferência): uma soma
+    corrida persistida acumularia erro de arredondamento a cada dia e podia
+    virar o sinal com o close colado na média. Um "sum" de caches antigos é
+    ignorado.
+
+    Retorna (signal, close, cache_atualizado) — cache None quando a janela
+    não está cheia/limpa (sinal 0, como em last_signal) — ou None sem dados.
+    """
+    if df is None or len(df) == 0:
+        return None
+
+    out = _ensure_datetime_index(df)
+    if out.empty:
+        return None
+
+    close = _extract_close_series(out)
+    dates = close.index
+    w = int(sma_window)
+    # escalares via .iat e só as fatias necessárias viram array (não a série toda)
+    last = float(close.iat[-1])
+
+    tail = prev.get("window_tail") if isinstance(prev, dict) else None
+    start = None
+    if tail is not None and len(tail) == w and prev.get("date"):
+        prev_date = pd.Timestamp(prev["date"])
+        pos = int(dates.searchsorted(prev_date))
+        # a janela do cache inteira precisa bater com o histórico (O(w)):
+        # qualquer barra revisada dentro dela força a reconstrução
+        if pos < len(dates) and dates[pos] == prev_date and pos + 1 >= w:
+            cur = close.iloc[pos + 1 - w : pos + 1].to_numpy(dtype=np.float64)
+            if np.array_equal(cur, np.asarray(tail, dtype=np.float64)):
+                start = pos + 1
+
+    new = close.iloc[start:].to_numpy(dtype=np.float64) if start is not None else None
+    if new is not None and len(new) < w and not np.isnan(new).any():
+        window = np.concatenate((np.asarray(tail[len(new):], dtype=np.float64), new))
+    else:
+        window = close.iloc[-w:].to_numpy(dtype=np.float64)
+        if len(window) < w or np.isnan(window).any():
+            return 0, last, None
+
+    signal = 1 if last > float(window.sum()) / w else 0
+    return signal, last, {"date": dates[-1].isoformat(), "window_tail": window.tolist()}
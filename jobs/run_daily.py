@@ -6,17 +6,51 @@ asset via the router (see ``core.router``), computes trend-following signals,
 weights, applies a kill switch, logs an event, and updates state. It is
 designed to be resilient to missing data by skipping tickers that return
 empty histories and logging a ``NO_DATA`` event when no ticker yields data.
+The final event/state writes run on a background writer
+(``core.storage_async``) that is drained before the process exits and before
+the next ``run()`` in the same process reads the state; a failed write makes
+the job exit non-zero.
+
+Equity is marked to market (``core.portfolio.mark_to_market``) only with
+``M2M_EQUITY=1``; otherwise it stays fixed and the drawdown kill switch
+cannot trip, as before the M2M accounting existed.
+
+A second invocation on the same UTC day (e.g. a retried cron job) logs
+``RUN_SKIPPED`` and returns without fetching; so does a run with the kill
+switch already tripped, or after ``DATA_FAILURE_LIMIT`` consecutive
+``NO_DATA`` runs (provider outage circuit breaker; one probe run goes through
+every ``DATA_FAILURE_PROBE_DAYS`` days, and a probe with data closes it).
+Outage skips and ``NO_DATA`` runs print a GitHub Actions ``::warning::``. Set
+``FORCE_RERUN=1`` (the workflow's ``force_rerun`` input) to run anyway (a kill
+switch still needs to be reset in the state).
+
+NumPy/pandas and the strategy/portfolio/router modules are imported lazily
+(``_lazy_imports``) after those checks, so the skip paths never pay the
+pandas/yfinance import cost.
 """
+from __future__ import annotations
 
 import os
+import sys
 import datetime as dt
-from typing import Dict, List
+import functools
+import hashlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-from core.data import DATA_PROVIDER_VERSION
-from core.storage import load_state, save_state, log_event
-from core.strategy import signal_on_off
-from core.portfolio import compute_weights, update_kill_switch, diff_states
-from core.router import route_fetch_history
+from core import DATA_PROVIDER_VERSION
+from core import storage
+from core.storage import load_state
+from core.storage_async import drain, log_event_async, save_state_async
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Bound by _lazy_imports() on the first run that gets past the short-circuits
+np = None
+signal_on_off_incremental = None
+compute_weights = update_kill_switch = diff_states = None
+extract_prev_weights = mark_to_market = missing_prices = None
+route_fetch_history_many = None
 
 try:
     import tomllib  # Python 3.11+
@@ -24,17 +58,79 @@ except Exception:
     tomllib = None
 
 CONFIG_FILE = "config.toml"
+# production state dir; other configs get a subdirectory (state_dir_for)
+_BASE_STATE_DIR = storage.STATE_DIR
+_UTC = dt.timezone.utc
+FETCH_WORKERS = 8
+FORCE_RERUN = os.getenv("FORCE_RERUN", "0") == "1"
+DATA_FAILURE_LIMIT = int(os.getenv("DATA_FAILURE_LIMIT", "3"))
+# while the breaker is open, let one run through this many days after the last
+DATA_FAILURE_PROBE_DAYS = int(os.getenv("DATA_FAILURE_PROBE_DAYS", "3"))
+# Mark equity to market on each run. Opt-in: with equity moving the drawdown
+# kill switch can trip, and a tripped switch flattens the book for good (see
+# the KILL_SWITCH_ACTIVE skip); off keeps the fixed-equity behaviour
+M2M_EQUITY = os.getenv("M2M_EQUITY", "0") == "1"
+# per-ticker M2M breakdown in the state (off: production state stays compact)
+DEBUG_M2M = os.getenv("DEBUG_M2M", "0") == "1"
+
+
+def _lazy_imports() -> None:
+    """Import the heavy modules once; names already bound (e.g. patched) are kept."""
+    global np, signal_on_off_incremental, compute_weights, update_kill_switch
+    global diff_states, extract_prev_weights, mark_to_market, missing_prices, route_fetch_history_many
+    import numpy
+    from core import portfolio, router, strategy
+
+    np = np or numpy
+    signal_on_off_incremental = signal_on_off_incremental or strategy.signal_on_off_incremental
+    compute_weights = compute_weights or portfolio.compute_weights
+    update_kill_switch = update_kill_switch or portfolio.update_kill_switch
+    diff_states = diff_states or portfolio.diff_states
+    extract_prev_weights = extract_prev_weights or portfolio.extract_prev_weights
+    mark_to_market = mark_to_market or portfolio.mark_to_market
+    missing_prices = missing_prices or portfolio.missing_prices
+    route_fetch_history_many = route_fetch_history_many or router.route_fetch_history_many
+
+
+def state_dir_for(config_path: Optional[str]) -> str:
+    """State directory for a config: ``state/`` for ``CONFIG_FILE``, else ``state/<config stem>/``.
+
+    Keeps an alternative config from resetting (and overwriting) the
+    production state, whose ``state_id`` it wouldn't match.
+    """
+    if not config_path or os.path.abspath(config_path) == os.path.abspath(CONFIG_FILE):
+        return _BASE_STATE_DIR
+    stem = os.path.splitext(os.path.basename(config_path))[0]
+    return os.path.join(_BASE_STATE_DIR, stem)
 
 
-def load_config() -> Dict:
+def load_config(path: Optional[str] = None) -> Dict:
     """Load configuration from ``config.toml`` if it exists.
 
+    The parsed dict is memoized per ``(path, mtime_ns)`` (only the latest
+    version is kept), so repeated calls (e.g. when the job is imported for
+    backtests) skip the TOML parse until the file changes. Callers must not
+    mutate the returned dict.
+
+    Args:
+        path: Config file to read (default ``CONFIG_FILE``).
+
     Returns:
         Configuration dictionary (empty if file missing or tomllib unavailable).
     """
-    if tomllib is None or not os.path.exists(CONFIG_FILE):
+    if tomllib is None:
+        return {}
+    path = path or CONFIG_FILE
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
         return {}
-    with open(CONFIG_FILE, "rb") as f:
+    return _load_config_cached(path, mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_config_cached(path: str, mtime_ns: int) -> Dict:
+    with open(path, "rb") as f:
         return tomllib.load(f)
 
 
@@ -45,7 +141,9 @@ def universe_from_config(cfg: Dict) -> List[Dict[str, str]]:
     structured format where each asset is a dict containing ``ticker``,
     ``type``, and ``market``. If the structured format is detected under
     ``universe.assets`` it is returned directly; otherwise the legacy format
-    is converted assuming all instruments are ETFs on B3.
+    is converted assuming all instruments are ETFs on B3. Duplicate tickers
+    (e.g. two roles resolving to the same proxy) are kept once, first entry
+    wins, so each ticker is fetched once.
 
     Args:
         cfg: Parsed configuration dictionary.
@@ -67,7 +165,7 @@ def universe_from_config(cfg: Dict) -> List[Dict[str, str]]:
             market = str(a.get("market", "B3")).strip().upper()
             normalized.append({"ticker": ticker, "type": asset_type, "market": market})
         if normalized:
-            return normalized
+            return _dedupe_assets(normalized)
 
     # Legacy behaviour: treat values in universe keys as tickers for ETFs on B3
     tickers: List[str] = []
@@ -77,12 +175,24 @@ def universe_from_config(cfg: Dict) -> List[Dict[str, str]]:
             tickers.append(str(val).strip().upper())
     if not tickers:
         tickers = ["BOVA11", "IVVB11", "IMAB11", "GOLD11"]
-    return [{"ticker": t, "type": "ETF", "market": "B3"} for t in tickers]
+    return [{"ticker": t, "type": "ETF", "market": "B3"} for t in dict.fromkeys(tickers)]
+
+
+def _dedupe_assets(assets: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Keep the first entry per ticker, in config order."""
+    unique: Dict[str, Dict[str, str]] = {}
+    for a in assets:
+        unique.setdefault(a["ticker"], a)
+    return list(unique.values())
 
 
 def state_identity(cfg: Dict, tickers: List[str]) -> str:
     """Generate a state identity string based on configuration and universe.
 
+    The identity is a 16-byte blake2b digest of the sorted universe, the
+    trend reference/window and the data provider version: constant size in
+    the state file and insensitive to ticker order.
+
     Args:
         cfg: Configuration dictionary.
         tickers: List of ticker symbols.
@@ -93,9 +203,53 @@ def state_identity(cfg: Dict, tickers: List[str]) -> str:
     trend_cfg = cfg.get("trend") or {}
     window = int(trend_cfg.get("window", 126))
     ref = str(trend_cfg.get("reference", "SMA")).upper()
+    return _state_identity_cached(tuple(sorted(tickers)), ref, window, DATA_PROVIDER_VERSION)
+
+
+@functools.lru_cache(maxsize=8)
+def _state_identity_cached(tickers: Tuple[str, ...], ref: str, window: int, provider: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(",".join(tickers).encode())
+    h.update(f"|{ref}:{window}|{provider}".encode())
+    return h.hexdigest()
+
+
+def legacy_state_identity(cfg: Dict, tickers: List[str]) -> str:
+    """Readable identity used before the digest (``UNIV=...|TREND=...``).
+
+    Only used to migrate existing states without resetting them.
+    """
+    trend_cfg = cfg.get("trend") or {}
+    window = int(trend_cfg.get("window", 126))
+    ref = str(trend_cfg.get("reference", "SMA")).upper()
     return f"UNIV={','.join(tickers)}|TREND={ref}:{window}|PROVIDER={DATA_PROVIDER_VERSION}"
 
 
+def history_period(trend_cfg: Dict, window: int) -> str:
+    """Pick the history period to fetch for the trend filter.
+
+    Only the last ``window`` bars feed the final SMA, so instead of always
+    pulling 10 years the period is sized to ~3x the window (at least one
+    year of trading days). ``trend.history_period`` overrides it, e.g. for
+    backtests that need the long series.
+
+    Args:
+        trend_cfg: The ``[trend]`` config section.
+        window: SMA window in bars.
+
+    Returns:
+        Provider period string (``"1y"``, ``"2y"``, ``"5y"`` or ``"10y"``).
+    """
+    override = trend_cfg.get("history_period")
+    if override:
+        return str(override).strip().lower()
+    need_days = max(window * 3, 252)
+    for days, period in ((252, "1y"), (504, "2y"), (1260, "5y")):
+        if need_days <= days:
+            return period
+    return "10y"
+
+
 def reset_state(cfg: Dict, sid: str) -> Dict:
     """Initialize a new state dictionary when state shape changes.
 
@@ -106,81 +260,212 @@ def reset_state(cfg: Dict, sid: str) -> Dict:
     Returns:
         State dictionary with default values.
     """
-    init_eq = float((cfg.get("system") or {}).get("initial_equity", 100000.0))
-    return {
+    return ensure_state_shape({}, sid, initial_equity(cfg))
+
+
+def initial_equity(cfg: Dict) -> float:
+    """Starting equity from ``[system].initial_equity`` (default 100k)."""
+    return float((cfg.get("system") or {}).get("initial_equity", 100000.0))
+
+
+def ensure_state_shape(state: Dict, sid: str, equity_default: float) -> Dict:
+    """Fill missing state keys in one merge (existing values win).
+
+    Args:
+        state: State dictionary, updated in place.
+        sid: State identifier used when ``state_id`` is missing.
+        equity_default: Equity used when ``equity`` is missing.
+
+    Returns:
+        The same ``state`` dictionary.
+    """
+    equity = state.get("equity", equity_default)
+    defaults = {
         "state_id": sid,
-        "equity": init_eq,
-        "peak_equity": init_eq,
+        "equity": equity,
+        "peak_equity": equity,
         "last_drawdown": 0.0,
         "kill_switch": False,
         "positions": {},
         "last_prices": {},
+        "sma_cache": {},
+        "consecutive_data_failures": 0,
         "last_run": None,
     }
+    state |= {k: v for k, v in defaults.items() if k not in state}
+    return state
+
+
+def last_run_day(state: Dict) -> Optional[dt.date]:
+    """UTC day of the state's ``last_run`` (ISO, ``Z`` suffix), or ``None``."""
+    last_run = state.get("last_run")
+    if not last_run:
+        return None
+    try:
+        return dt.datetime.fromisoformat(str(last_run).rstrip("Z")).date()
+    except ValueError:
+        return None
+
+
+def ran_on(state: Dict, day: dt.date) -> bool:
+    """Whether the state's ``last_run`` falls on ``day`` (UTC)."""
+    return last_run_day(state) == day
+
+
+def data_probe_due(state: Dict, day: dt.date) -> bool:
+    """Whether an open data-failure breaker lets the run on ``day`` probe the providers.
+
+    Skipped runs don't touch ``last_run``, so it dates the last run that
+    fetched; a failed probe pushes the next one ``DATA_FAILURE_PROBE_DAYS`` out.
+    """
+    last = last_run_day(state)
+    return last is None or (day - last).days >= DATA_FAILURE_PROBE_DAYS
+
 
+def asset_signal(
+    asset: Dict[str, str],
+    df: Optional[pd.DataFrame],
+    window: int,
+    period: str,
+    sma_cache: Optional[Dict] = None,
+) -> Optional[Tuple[int, float, Optional[Dict]]]:
+    """Last ``(signal, close, sma_cache)`` for one asset, or ``None`` to skip it.
 
-def run() -> None:
+    Args:
+        asset: Universe entry (``ticker``, ``type``, ``market``).
+        df: Fetched history (may be ``None``/empty).
+        window: SMA window in bars.
+        period: Period that was fetched (for the warning message).
+        sma_cache: The asset's persisted SMA window from the previous run.
+
+    Returns:
+        ``(signal, close, sma_cache)`` tuple, or ``None`` when there is no
+        usable data. The cache entry is ``None`` when the window isn't full.
+    """
+    t = asset["ticker"]
+    if df is None or df.empty:
+        print(f"[WARN] Sem dados para {t} ({asset.get('type', 'ETF')}/{asset.get('market', 'B3')}). Pulando.")
+        return None
+    if len(df) < window:
+        print(f"[WARN] {t}: só {len(df)} barras para SMA {window} (period={period}); sinal fica 0.")
+    # Only the last bar's signal is used: slide the persisted SMA window over
+    # the new bars instead of building the full SMA series
+    try:
+        last = signal_on_off_incremental(sma_cache, df, sma_window=window)
+    except ValueError as exc:  # e.g. provider frame without a Close column
+        print(f"[WARN] Histórico inválido para {t}: {exc}. Pulando.")
+        return None
+    if last is None:
+        print(f"[WARN] Sinal vazio para {t}. Pulando.")
+    return last
+
+
+def run(config_path: Optional[str] = None) -> None:
     """Main entrypoint for the daily job.
 
     Loads configuration and state, fetches data via the router, computes
     signals and weights, applies kill switch logic, logs events, and saves
     state. Handles missing data gracefully by skipping tickers and logging
     a ``NO_DATA`` event when no valid histories are found.
+
+    Args:
+        config_path: Config file to run with (default ``CONFIG_FILE``). Any
+            other config keeps its own state under ``state_dir_for``.
     """
-    cfg = load_config()
+    # One timestamp for the whole run (events + state); same format as the
+    # old utcnow().isoformat() + "Z", without the deprecated call
+    now_dt = dt.datetime.now(_UTC)
+    now = now_dt.replace(tzinfo=None).isoformat() + "Z"
+    cfg = load_config(config_path)
     assets = universe_from_config(cfg)
     trend_cfg = cfg.get("trend") or {}
     window = int(trend_cfg.get("window", 126))
     ref = str(trend_cfg.get("reference", "SMA")).upper()
+    period = history_period(trend_cfg, window)
 
     kill_cfg = cfg.get("kill_switch") or {}
     max_dd = float(kill_cfg.get("max_drawdown", 0.20))
     kill_enabled = bool(kill_cfg.get("enabled", True))
 
+    # A previous run() in this process may still be writing its state
+    drain()
+    state_dir = state_dir_for(config_path)
+    if state_dir != storage.STATE_DIR:
+        storage.set_state_dir(state_dir)
     state = load_state()
-    sid = state_identity(cfg, [a["ticker"] for a in assets])
+    tickers = [a["ticker"] for a in assets]
+    sid = state_identity(cfg, tickers)
+
+    # States saved with the readable identity keep their equity/positions
+    if state.get("state_id") == legacy_state_identity(cfg, tickers):
+        state["state_id"] = sid
 
     # Ensure state has expected shape and id
     if state.get("state_id") and state.get("state_id") != sid:
         state = reset_state(cfg, sid)
     else:
-        state.setdefault("state_id", sid)
-        state.setdefault("equity", float((cfg.get("system") or {}).get("initial_equity", 100000.0)))
-        state.setdefault("peak_equity", state["equity"])
-        state.setdefault("last_drawdown", 0.0)
-        state.setdefault("kill_switch", False)
-        state.setdefault("positions", {})
-        state.setdefault("last_prices", {})
-        state.setdefault("last_run", None)
-
-    signals: Dict[str, int] = {}
-    prices: Dict[str, float] = {}
-    skipped: List[str] = []
-
-    # Fetch historical data for each asset via the router
-    for asset in assets:
-        t = asset["ticker"]
-        atype = asset.get("type", "ETF")
-        market = asset.get("market", "B3")
-        df = route_fetch_history(t, asset_type=atype, market=market, period="10y", interval="1d")
-        if df is None or df.empty:
-            print(f"[WARN] Sem dados para {t} ({atype}/{market}). Pulando.")
-            skipped.append(t)
-            continue
-        sig_df = signal_on_off(df, sma_window=window)
-        if sig_df is None or sig_df.empty:
-            print(f"[WARN] signal_on_off vazio para {t}. Pulando.")
-            skipped.append(t)
-            continue
-        last_row = sig_df.iloc[-1]
-        signals[t] = int(last_row["Signal"])
-        prices[t] = float(last_row["Close"])
-
-    now = dt.datetime.utcnow().isoformat() + "Z"
+        ensure_state_shape(state, sid, initial_equity(cfg))
+
+    # Short-circuits before any fetch
+    skip: Optional[Dict] = None
+    failures = int(state.get("consecutive_data_failures", 0))
+    if kill_enabled and state.get("kill_switch"):
+        # positions are already flat and nothing resets the switch
+        skip = {"reason": "KILL_SWITCH_ACTIVE"}
+    elif FORCE_RERUN:
+        pass
+    elif failures == 0 and state.get("positions") and ran_on(state, now_dt.date()):
+        # same-day rerun after a run with data: today's positions are in the state
+        skip = {"reason": "ALREADY_RAN_TODAY", "last_run": state.get("last_run")}
+    elif failures >= DATA_FAILURE_LIMIT and not data_probe_due(state, now_dt.date()):
+        skip = {"reason": "DATA_FAILURES", "consecutive_data_failures": failures}
+        # GitHub Actions annotation: an outage skip must not pass for a normal green run
+        print(
+            f"::warning::RUN_SKIPPED: {failures} execuções seguidas sem dados; "
+            f"próxima tentativa em até {DATA_FAILURE_PROBE_DAYS} dia(s) (FORCE_RERUN=1 força)."
+        )
+    if skip is not None:
+        log_event_async(
+            {
+                "type": "RUN_SKIPPED",
+                "ts": now,
+                "provider": DATA_PROVIDER_VERSION,
+                "state_id": sid,
+                **skip,
+            }
+        )
+        return
+
+    _lazy_imports()
+
+    # Fetch historical data for all assets in one batched pass (one download
+    # per Yahoo market, thread pools for BRAPI/FX), sized to the SMA window
+    histories = route_fetch_history_many(
+        [(a["ticker"], a.get("type", "ETF"), a.get("market", "B3")) for a in assets],
+        period=period,
+        interval="1d",
+        max_workers=FETCH_WORKERS,
+    )
+
+    # One (signal, close, sma_cache) or None per asset, then each output built in one shot
+    # Sequential on purpose: the per-asset work (~90us) is pandas code that
+    # holds the GIL, so a thread pool only adds overhead
+    sma_cache = state.get("sma_cache") or {}
+    results = [
+        asset_signal(a, histories.get(a["ticker"]), window, period, sma_cache.get(a["ticker"]))
+        for a in assets
+    ]
+    signals: Dict[str, int] = {a["ticker"]: r[0] for a, r in zip(assets, results) if r is not None}
+    prices: Dict[str, float] = {a["ticker"]: r[1] for a, r in zip(assets, results) if r is not None}
+    skipped: List[str] = [a["ticker"] for a, r in zip(assets, results) if r is None]
+    # skipped tickers keep their entry: next run resumes from it
+    state["sma_cache"] = sma_cache | {
+        a["ticker"]: r[2] for a, r in zip(assets, results) if r is not None and r[2] is not None
+    }
 
     # If no valid signals, log and exit gracefully
     if not signals:
-        log_event(
+        log_event_async(
             {
                 "type": "NO_DATA",
                 "ts": now,
@@ -188,40 +473,92 @@ def run() -> None:
                 "state_id": sid,
                 "message": "Nenhum ticker retornou dados válidos.",
                 "skipped": skipped,
-                "universe": [a["ticker"] for a in assets],
+                "universe": tickers,
             }
         )
         state["last_run"] = now
-        save_state(state)
+        state["consecutive_data_failures"] = failures + 1
+        print(f"::warning::NO_DATA: nenhum ticker retornou dados ({failures + 1} execução(ões) seguida(s)).")
+        save_state_async(state)
         return
 
-    # Compute weights from signals
-    weights = compute_weights(signals)
+    state["consecutive_data_failures"] = 0
 
-    # Apply kill switch if enabled
+    # Mark yesterday's positions to today's closes before the drawdown check
+    port_ret: Optional[float] = None
+    if M2M_EQUITY:
+        prev_weights = extract_prev_weights(state.get("positions"))
+        prev_prices = state.get("last_prices") or {}
+        port_ret, m2m_used = mark_to_market(prev_weights, prev_prices, prices, details=DEBUG_M2M)
+        state["equity"] = float(state.get("equity", 100000.0)) * (1.0 + port_ret)
+        state["last_m2m"] = {"ts": now, "port_ret": port_ret, "missing": missing_prices(prev_weights, prev_prices, prices)}
+    else:
+        m2m_used = None
+        state.pop("last_m2m", None)
+    if m2m_used is not None:
+        state["last_m2m_details"] = {"ts": now, "port_ret": port_ret, "used": m2m_used}
+    else:
+        # left over from a DEBUG_M2M (or M2M_EQUITY) run: keep the production state compact
+        state.pop("last_m2m_details", None)
+
+    # Held tickers skipped today keep yesterday's position (and last price,
+    # below): their P&L is marked on the next run that has a close for them
+    held = {
+        t: float(state["positions"][t].get("weight", 0.0))
+        for t in skipped
+        if t in (state.get("positions") or {})
+    }
+
+    # Apply kill switch if enabled (checked first: a tripped switch zeroes
+    # everything, so compute_weights would be wasted work)
+    kill = False
     if kill_enabled:
         equity = float(state.get("equity", 100000.0))
         peak_eq = float(state.get("peak_equity", equity))
-        kill, new_peak = update_kill_switch(equity, peak_eq, max_dd)
+        kill, new_peak, _dd = update_kill_switch(equity, peak_eq, max_dd)
         state["peak_equity"] = float(new_peak)
         if kill:
             state["kill_switch"] = True
-            # Zero out weights and signals for the effective universe
-            weights = {t: 0.0 for t in signals.keys()}
-            signals = {t: 0 for t in signals.keys()}
+            # Zero out weights and signals for the effective universe; held
+            # skipped tickers are flattened too
+            weights = dict.fromkeys([*signals, *held], 0.0)
+            signals = dict.fromkeys(signals, 0)
+
+    # Compute weights from signals; the ON tickers share what the held
+    # skipped tickers leave
+    if not kill:
+        weights = compute_weights(signals)
+        if held:
+            rest = max(0.0, 1.0 - sum(held.values()))
+            weights = {t: w * rest for t, w in weights.items()}
 
     # Compute orders based on difference between current and target positions
     orders = diff_states(state.get("positions", {}), weights)
 
     # Persist positions and last prices for the effective universe
-    state["positions"] = {
-        t: {
-            "state": 1 if weights.get(t, 0.0) > 0 else 0,
-            "weight": float(weights.get(t, 0.0)),
-        }
-        for t in signals.keys()
-    }
-    state["last_prices"] = prices
+    # Array-backed (SoA) positions: one weights pass, states vectorized;
+    # tolist() hands back plain Python ints/floats for the JSON state
+    pos_tickers = list(weights)
+    weights_arr = np.fromiter(
+        (weights.get(t, 0.0) for t in pos_tickers), dtype=np.float64, count=len(pos_tickers)
+    )
+    states_arr = (weights_arr > 0.0).astype(np.int8)
+    # Update the existing per-ticker dicts in place; drop tickers that left
+    # (skipped tickers stay)
+    positions = state.setdefault("positions", {})
+    for t, s, w in zip(pos_tickers, states_arr.tolist(), weights_arr.tolist()):
+        slot = positions.get(t)
+        if slot is None:
+            positions[t] = {"state": s, "weight": w}
+        else:
+            slot["state"] = s
+            slot["weight"] = w
+    for t in positions.keys() - weights.keys() - held.keys():
+        del positions[t]
+    last_prices = state.setdefault("last_prices", {})
+    for t in last_prices.keys() - prices.keys() - held.keys():
+        del last_prices[t]
+    last_prices.update(prices)
     state["last_run"] = now
 
     # Update drawdown
@@ -230,7 +567,7 @@ def run() -> None:
     if peak_eq > 0:
         state["last_drawdown"] = float((peak_eq - equity) / peak_eq)
 
-    log_event(
+    log_event_async(
         {
             "type": "RUN",
             "ts": now,
@@ -238,18 +575,25 @@ def run() -> None:
             "state_id": sid,
             "kill_switch": state.get("kill_switch", False),
             "trend": {"reference": ref, "window": window},
-            "universe": [a["ticker"] for a in assets],
+            "universe": tickers,
             "effective_universe": list(signals.keys()),
             "skipped": skipped,
             "signals": signals,
             "weights": weights,
             "prices": prices,
             "orders": orders,
+            "port_ret": port_ret,
+            "equity": state["equity"],
         }
     )
 
-    save_state(state)
+    save_state_async(state)
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    # python jobs/run_daily.py [config.toml]
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
+    # Explicit drain: a failed background write raises here and the job exits
+    # non-zero (from the atexit hook it would only be printed), so CI never
+    # commits an events.log that is ahead of state.json
+    drain()
\ No newline at end of file